@@ -1,21 +1,67 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import json
+import sqlite3
 import os
 import io
 import requests
 import shutil
+import subprocess
+import tempfile
+import abc
 import re
-from datetime import datetime, timedelta
+import hashlib
+import marshal
+import threading
+import time
+import zipfile
+import multiprocessing
+import difflib
+import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from collections import OrderedDict, namedtuple
+from collections.abc import Mapping
+from contextlib import contextmanager, nullcontext
+from datetime import datetime, date, timedelta
+from functools import lru_cache
 from base64 import b64decode
+from pandas.io.parsers import TextParser
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 # محاولة استيراد PyGithub (لرفع التعديلات)
 try:
-    from github import Github
+    from github import Github, GithubException
     GITHUB_AVAILABLE = True
 except Exception:
     GITHUB_AVAILABLE = False
 
+# محاولة استيراد streamlit-autorefresh (لتحديث الصفحة تلقائياً)
+try:
+    from streamlit_autorefresh import st_autorefresh
+    AUTOREFRESH_AVAILABLE = True
+except Exception:
+    AUTOREFRESH_AVAILABLE = False
+
+# محاولة استيراد fcntl (قفل الملفات بين العمليات للمستودع المحلي - غير متوفر على Windows)
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# تفعيل Copy-on-Write في pandas 2.x (افتراضي في 3.x) حتى لا تُعدَّل اللقطة المشتركة بين الجلسات
+if int(pd.__version__.split(".")[0]) < 3:
+    pd.set_option("mode.copy_on_write", True)
+
+# محاولة استيراد pyarrow (للقطات العمودية السريعة للملف)
+try:
+    import pyarrow as pa
+    import pyarrow.feather as feather
+    PYARROW_AVAILABLE = True
+except Exception:
+    PYARROW_AVAILABLE = False
+
 # ===============================
 # ⚙ إعدادات التطبيق - يمكن تعديلها بسهولة
 # ===============================
@@ -29,6 +75,43 @@ APP_CONFIG = {
     "BRANCH": "main",
     "FILE_PATH": "l6.xlsx",
     "LOCAL_FILE": "l6.xlsx",
+    "GITHUB_WEB_URL": "https://github.com",  # يمكن تغييرها لخادم HTTP محلي للاختبار
+    "GITHUB_API_URL": "https://api.github.com",
+    "FETCH_META_FILE": ".fetch_meta.json",  # ETag وبصمة آخر نسخة تم جلبها
+    "SYNC_BACKEND": "github",  # "github" أو "local" (مستودع git bare أو مجلد على القرص - للاختبار وقياس الأداء بدون GitHub)
+    "LOCAL_SYNC_PATH": "",  # مسار المستودع/المجلد عند SYNC_BACKEND = "local"
+    "HTTP_TIMEOUT": (5, 30),  # (مهلة الاتصال, مهلة القراءة) بالثواني
+    "HTTP_RETRIES": 3,
+    "HTTP_BACKOFF": 0.5,  # انتظار متزايد بين المحاولات: 0.5, 1, 2 ...
+    "HTTP_POOL_SIZE": 4,
+    
+    # إعدادات الأداء
+    "SNAPSHOT_DIR": ".snapshots",
+    "SNAPSHOT_KEEP": 2,
+    "LAZY_SHEET_CACHE_SIZE": 8,
+    "SEARCH_CHUNK_ROWS": 512,
+    "PARSE_WORKERS": 0,  # 0 = عدد أنوية المعالج
+    "PARALLEL_PARSE_MIN_BYTES": 1024 * 1024,
+    "TEXT_CACHE_SIZE": 4096,  # عدد النصوص المحفوظة بعد التطبيع وتقسيم أسماء الخدمات
+    # الاختلاف في المسافات والشرطات وحالة الأحرف يُطابق تلقائياً بدون إضافته هنا
+    "SERVICE_ALIASES": {},  # أسماء بديلة للخدمات: {"الاسم الموحد": ["اسم بديل", ...]}
+    "SERVICE_RESULT_CACHE_SIZE": 64,  # نتائج فحص السيرفيس المحفوظة (ماكينة × شرائح × نسخة الملف)
+    "FLEET_WORKERS": 0,  # خيوط فحص السيرفيس لكل الماكينات (0 = عدد أنوية المعالج)
+    
+    # إعدادات المزامنة مع GitHub في الخلفية
+    "SYNC_QUEUE_FILE": ".sync_queue.json",
+    "SYNC_COALESCE_SECONDS": 10,  # تجميع التعديلات المتتالية خلال هذه المدة في commit واحد
+    "SYNC_RETRY_SECONDS": 60,
+    "SYNC_BASE_FILE": ".sync_base.xlsx",  # آخر نسخة مشتركة مع GitHub (أساس الدمج الثلاثي)
+    "POLL_INTERVAL_SECONDS": 60,  # فحص وجود نسخة جديدة على GitHub في الخلفية (0 = إيقاف، ومتوقف دائماً بدون GitHub token)
+    "AUTO_REFRESH_SECONDS": 0,  # كل كم ثانية يُفحص وصول نسخة جديدة لإعادة تحميل الصفحة بها (0 = إيقاف، ولا يشمل من يملك صلاحية التعديل)
+    "EVENT_JOURNAL_FILE": ".event_journal.jsonl",  # الأحداث الجديدة قبل دمجها في ملف Excel
+    "JOURNAL_COMPACT_ROWS": 50,  # دمج السجل في الملف عند هذا العدد من الأحداث
+    "JOURNAL_COMPACT_SECONDS": 600,  # أو عندما يمر هذا الوقت على أقدم حدث
+    
+    # مصدر الاستعلامات: "xlsx" (الجداول في الذاكرة) أو "sqlite" (نسخة مفهرسة من الملف، يبقى xlsx للتبادل والتصدير)
+    "STORAGE_BACKEND": "xlsx",
+    "SQLITE_FILE": ".workbook.sqlite",
     
     # إعدادات الأمان
     "MAX_ACTIVE_USERS": 2,
@@ -48,7 +131,8 @@ SESSION_DURATION = timedelta(minutes=APP_CONFIG["SESSION_DURATION_MINUTES"])
 MAX_ACTIVE_USERS = APP_CONFIG["MAX_ACTIVE_USERS"]
 
 # إنشاء رابط GitHub تلقائياً من الإعدادات
-GITHUB_EXCEL_URL = f"https://github.com/{APP_CONFIG['REPO_NAME'].split('/')[0]}/{APP_CONFIG['REPO_NAME'].split('/')[1]}/raw/{APP_CONFIG['BRANCH']}/{APP_CONFIG['FILE_PATH']}"
+GITHUB_EXCEL_URL = f"{APP_CONFIG['GITHUB_WEB_URL']}/{APP_CONFIG['REPO_NAME'].split('/')[0]}/{APP_CONFIG['REPO_NAME'].split('/')[1]}/raw/{APP_CONFIG['BRANCH']}/{APP_CONFIG['FILE_PATH']}"
+GITHUB_CONTENTS_API_URL = f"{APP_CONFIG['GITHUB_API_URL']}/repos/{APP_CONFIG['REPO_NAME']}/contents/{APP_CONFIG['FILE_PATH']}"
 
 # -------------------------------
 # 🧩 دوال مساعدة للملفات والحالة
@@ -265,256 +349,2642 @@ def login_ui():
             logout_action()
         return True
 
+# -------------------------------
+# 🌐 اتصال مشترك مع GitHub (جلسة HTTP وعميل API يُعاد استخدامهما)
+# -------------------------------
+def _http_retry():
+    return Retry(
+        total=APP_CONFIG["HTTP_RETRIES"],
+        backoff_factor=APP_CONFIG["HTTP_BACKOFF"],
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=frozenset({"GET", "HEAD"}),
+        respect_retry_after_header=True,
+    )
+
+@st.cache_resource(show_spinner=False)
+def get_http_session():
+    """جلسة requests واحدة لكل العملية (keep-alive + إعادة محاولة مع انتظار متزايد)"""
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=APP_CONFIG["HTTP_POOL_SIZE"],
+        pool_maxsize=APP_CONFIG["HTTP_POOL_SIZE"],
+        max_retries=_http_retry(),
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+@st.cache_resource(show_spinner=False, max_entries=4)
+def get_github_repo(token):
+    """عميل PyGithub ومستودع الملف مرة واحدة لكل توكن (بدون get_repo مع كل حفظ)"""
+    g = Github(
+        token,
+        timeout=APP_CONFIG["HTTP_TIMEOUT"][1],
+        retry=_http_retry(),
+        pool_size=APP_CONFIG["HTTP_POOL_SIZE"],
+    )
+    return g.get_repo(APP_CONFIG["REPO_NAME"])
+
+@st.cache_resource(show_spinner=False)
+def get_remote_file_state():
+    """آخر blob sha معروف للملف لكل مصدر مزامنة (لرفع التعديل بطلب واحد بدون قراءة النسخة الحالية)"""
+    return {}
+
+# -------------------------------
+# 🔌 مصدر المزامنة: GitHub أو مستودع/مجلد محلي
+# -------------------------------
+# content: محتوى الملف، sha: بصمة git blob للمحتوى، etag: للطلبات المشروطة
+RemoteFile = namedtuple("RemoteFile", ["content", "sha", "etag"])
+
+class SyncConflict(Exception):
+    """الملف تغير في المصدر منذ آخر sha معروف"""
+
+class SyncBackend(abc.ABC):
+    """واجهة مصدر المزامنة: جلب مشروط، قراءة النسخة الحالية، وكتابة مشروطة بآخر sha"""
+
+    key = ""
+    label = ""
+    can_push = False
+    can_poll = True
+
+    @abc.abstractmethod
+    def fetch(self, etag=None):
+        """النسخة الحالية، أو None إذا كانت نفس نسخة etag"""
+
+    @abc.abstractmethod
+    def current(self):
+        """النسخة الحالية (None إذا لم يكن الملف موجوداً)"""
+
+    def revision(self):
+        """sha النسخة الحالية من المصدر نفسه وليس من نسخة مخزنة مؤقتاً (None إذا لم يكن الملف موجوداً)"""
+        current = self.current()
+        return current.sha if current is not None else None
+
+    @abc.abstractmethod
+    def write(self, content, message, sha):
+        """كتابة نسخة جديدة فوق النسخة sha (None = ملف جديد)؛ ترفع SyncConflict إذا تغير الملف، وتُرجع sha الجديد"""
+
+    def push_unavailable_reason(self):
+        return None
+
+class GitHubSyncBackend(SyncBackend):
+    """المزامنة مع GitHub: الجلب من رابط RAW والرفع عبر PyGithub"""
+
+    label = "GitHub"
+
+    def __init__(self, token):
+        self.token = token
+        self.key = f"github:{APP_CONFIG['REPO_NAME']}@{APP_CONFIG['BRANCH']}/{APP_CONFIG['FILE_PATH']}"
+        self.can_push = bool(token) and GITHUB_AVAILABLE
+        # contents API بدون token مسموح بـ 60 طلباً في الساعة فقط، يستهلكها الفحص الدوري كلها
+        self.can_poll = bool(token)
+
+    def push_unavailable_reason(self):
+        if not GITHUB_AVAILABLE:
+            return "⚠ PyGithub غير متوفر. سيتم الحفظ محلياً فقط."
+        if not self.token:
+            return "⚠ لم يتم العثور على GitHub token. سيتم الحفظ محلياً فقط."
+        return None
+
+    def fetch(self, etag=None):
+        headers = {"If-None-Match": etag} if etag else {}
+        response = get_http_session().get(GITHUB_EXCEL_URL, headers=headers, timeout=APP_CONFIG["HTTP_TIMEOUT"])
+        if response.status_code == 304:
+            return None
+        response.raise_for_status()
+        return RemoteFile(response.content, git_blob_sha(response.content), response.headers.get("ETag"))
+
+    def revision(self):
+        # contents API وليس رابط RAW: الرابط يمر عبر CDN وقد يرجع نسخة قديمة لعدة دقائق
+        headers = {"Accept": "application/vnd.github+json"}
+        if self.token:
+            headers["Authorization"] = f"token {self.token}"
+        response = get_http_session().get(
+            GITHUB_CONTENTS_API_URL, params={"ref": APP_CONFIG["BRANCH"]}, headers=headers, timeout=APP_CONFIG["HTTP_TIMEOUT"]
+        )
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+        return response.json().get("sha")
+
+    def current(self):
+        repo = get_github_repo(self.token)
+        try:
+            remote = repo.get_contents(APP_CONFIG["FILE_PATH"], ref=APP_CONFIG["BRANCH"])
+        except GithubException as e:
+            if e.status == 404:
+                return None
+            raise
+        # الملفات الأكبر من 1MB لا يُرجع API محتواها، فتُقرأ عبر blob
+        if remote.encoding == "base64":
+            content = remote.decoded_content
+        else:
+            content = b64decode(repo.get_git_blob(remote.sha).content)
+        return RemoteFile(content, remote.sha, None)
+
+    def write(self, content, message, sha):
+        repo = get_github_repo(self.token)
+        try:
+            if sha is None:
+                result = repo.create_file(path=APP_CONFIG["FILE_PATH"], message=message, content=content, branch=APP_CONFIG["BRANCH"])
+            else:
+                result = repo.update_file(path=APP_CONFIG["FILE_PATH"], message=message, content=content, sha=sha, branch=APP_CONFIG["BRANCH"])
+        except GithubException as e:
+            if e.status in (409, 422):
+                raise SyncConflict(str(e))
+            raise
+        return result["content"].sha
+
+class LocalSyncBackend(SyncBackend):
+    """المزامنة مع مستودع git bare (commit لكل رفع) أو مجلد عادي على القرص
+
+    الكتابة مشروطة بآخر sha مثل GitHub، مع قفل ملف بين العمليات، فيمكن قياس الجلب والرفع والتعارضات بدون الشبكة.
+    """
+
+    label = "المستودع المحلي"
+    can_push = True
+
+    def __init__(self, path):
+        if not path:
+            raise ValueError('LOCAL_SYNC_PATH فارغ: حدد مسار المستودع أو المجلد عند SYNC_BACKEND = "local"')
+        self.path = os.path.abspath(path)
+        # الكتابة في مجلد التطبيق نفسه تستبدل الملف المحلي وملفات التطبيق بدل مزامنتها
+        app_dirs = {os.getcwd(), os.path.dirname(os.path.abspath(APP_CONFIG["LOCAL_FILE"]))}
+        if self.path in app_dirs:
+            raise ValueError(f"LOCAL_SYNC_PATH ({path}) هو مجلد التطبيق نفسه: اختر مجلداً منفصلاً للمزامنة")
+        self.key = f"local:{self.path}"
+        self.is_git = os.path.isfile(os.path.join(self.path, "HEAD")) and os.path.isdir(os.path.join(self.path, "objects"))
+        self._thread_lock = threading.Lock()
+        os.makedirs(self.path, exist_ok=True)
+
+    def _git(self, *args, input=None, env=None):
+        result = subprocess.run(
+            ["git", f"--git-dir={self.path}", *args],
+            input=input, env=env, capture_output=True, check=True,
+        )
+        return result.stdout
+
+    @contextmanager
+    def _locked(self):
+        """قفل بين الخيوط وبين العمليات (fcntl) حول قراءة sha والكتابة"""
+        with self._thread_lock, open(os.path.join(self.path, "sync.lock"), "w") as handle:
+            if fcntl is not None:
+                fcntl.flock(handle, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(handle, fcntl.LOCK_UN)
+
+    def _head(self):
+        try:
+            return self._git("rev-parse", "--verify", "-q", f"refs/heads/{APP_CONFIG['BRANCH']}").decode().strip()
+        except subprocess.CalledProcessError:
+            return None
+
+    def _current_sha(self):
+        if self.is_git:
+            head = self._head()
+            if head is None:
+                return None
+            try:
+                return self._git("rev-parse", f"{head}:{APP_CONFIG['FILE_PATH']}").decode().strip()
+            except subprocess.CalledProcessError:
+                return None
+        current = self.current()
+        return current.sha if current is not None else None
+
+    def current(self):
+        if self.is_git:
+            sha = self._current_sha()
+            if sha is None:
+                return None
+            return RemoteFile(self._git("cat-file", "blob", sha), sha, f'"{sha}"')
+
+        file_path = os.path.join(self.path, APP_CONFIG["FILE_PATH"])
+        if not os.path.exists(file_path):
+            return None
+        with open(file_path, "rb") as f:
+            content = f.read()
+        sha = git_blob_sha(content)
+        return RemoteFile(content, sha, f'"{sha}"')
+
+    def revision(self):
+        return self._current_sha()
+
+    def fetch(self, etag=None):
+        if self.is_git and etag and etag == f'"{self._current_sha()}"':
+            return None
+        current = self.current()
+        if current is None:
+            raise FileNotFoundError(f"{APP_CONFIG['FILE_PATH']} غير موجود في {self.path}")
+        return None if etag and etag == current.etag else current
+
+    def write(self, content, message, sha):
+        with self._locked():
+            if self._current_sha() != sha:
+                raise SyncConflict(f"{APP_CONFIG['FILE_PATH']} تغير في {self.path}")
+            if self.is_git:
+                return self._git_commit(content, message)
+
+            file_path = os.path.join(self.path, APP_CONFIG["FILE_PATH"])
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+            tmp_path = temp_path_beside(file_path)
+            with open(tmp_path, "wb") as f:
+                f.write(content)
+            os.replace(tmp_path, file_path)
+            new_sha = git_blob_sha(content)
+            with open(os.path.join(self.path, "sync_log.jsonl"), "a", encoding="utf-8") as f:
+                f.write(json.dumps({"time": datetime.now().isoformat(), "sha": new_sha, "message": message}, ensure_ascii=False) + "\n")
+            return new_sha
+
+    def _git_commit(self, content, message):
+        blob = self._git("hash-object", "-w", "--stdin", input=content).decode().strip()
+        parent = self._head()
+        index_path = os.path.join(self.path, f"sync-index-{os.getpid()}")
+        env = dict(
+            os.environ, GIT_INDEX_FILE=index_path,
+            GIT_AUTHOR_NAME="Streamlit", GIT_AUTHOR_EMAIL="streamlit@localhost",
+            GIT_COMMITTER_NAME="Streamlit", GIT_COMMITTER_EMAIL="streamlit@localhost",
+        )
+        try:
+            if parent:
+                self._git("read-tree", parent, env=env)
+            self._git("update-index", "--add", "--cacheinfo", f"100644,{blob},{APP_CONFIG['FILE_PATH']}", env=env)
+            tree = self._git("write-tree", env=env).decode().strip()
+            parent_args = ["-p", parent] if parent else []
+            commit = self._git("commit-tree", tree, *parent_args, "-m", message, env=env).decode().strip()
+        finally:
+            if os.path.exists(index_path):
+                os.remove(index_path)
+        # update-ref مع القيمة القديمة: لا يُكتب فوق commit أضافه غيرنا
+        self._git("update-ref", f"refs/heads/{APP_CONFIG['BRANCH']}", commit, parent or "0" * 40)
+        return blob
+
+@st.cache_resource(show_spinner=False, max_entries=4)
+def _open_github_sync_backend(token):
+    return GitHubSyncBackend(token)
+
+@st.cache_resource(show_spinner=False, max_entries=4)
+def _open_local_sync_backend(path):
+    return LocalSyncBackend(path)
+
+def get_sync_backend():
+    """مصدر المزامنة حسب الإعدادات (SYNC_BACKEND)"""
+    if APP_CONFIG["SYNC_BACKEND"] == "local":
+        return _open_local_sync_backend(APP_CONFIG["LOCAL_SYNC_PATH"])
+    token = st.secrets.get("github", {}).get("token", None) if GITHUB_AVAILABLE else None
+    return _open_github_sync_backend(token)
+
 # -------------------------------
 # 🔄 طرق جلب الملف من GitHub
 # -------------------------------
+def temp_path_beside(path, suffix=".tmp"):
+    """مسار مؤقت فريد بجوار الملف (لا يتصادم بين الخيوط أو العمليات) حتى يبقى os.replace ذرياً"""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), prefix=f"{os.path.basename(path)}{suffix}-")
+    os.close(fd)
+    return tmp_path
+
+def write_local_workbook(content):
+    """كتابة محتوى الملف محلياً فقط إذا تغيرت بصمته (كتابة ذرية عبر ملف مؤقت)"""
+    path = APP_CONFIG["LOCAL_FILE"]
+    if os.path.exists(path) and hashlib.sha256(content).hexdigest() == compute_file_hash(path):
+        return False
+
+    tmp_path = temp_path_beside(path)
+    with open(tmp_path, "wb") as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+    return True
+
+def git_blob_sha(content):
+    """بصمة الملف بنفس طريقة Git (sha الذي يرجعه GitHub API للملف)"""
+    return hashlib.sha1(b"blob %d\0" % len(content) + content).hexdigest()
+
+def load_fetch_meta():
+    """قراءة ETag وبصمات آخر جلب لكل رابط"""
+    if not os.path.exists(APP_CONFIG["FETCH_META_FILE"]):
+        return {}
+    try:
+        with open(APP_CONFIG["FETCH_META_FILE"], "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception:
+        return {}
+
+def save_fetch_meta(url, **values):
+    """حفظ ETag/بصمة آخر جلب لرابط معين مع بصمة الملف المحلي وقتها"""
+    meta = load_fetch_meta()
+    meta[url] = dict(values, local_hash=get_workbook_hash())
+    try:
+        with open(APP_CONFIG["FETCH_META_FILE"], "w", encoding="utf-8") as f:
+            json.dump(meta, f, indent=2)
+    except Exception:
+        pass
+
+def conditional_etag(key):
+    """آخر ETag فقط إذا كان الملف المحلي ما زال هو نفس النسخة التي جُلبت به"""
+    entry = load_fetch_meta().get(key)
+    if not entry or not entry.get("etag") or not os.path.exists(APP_CONFIG["LOCAL_FILE"]):
+        return None
+    if entry.get("local_hash") != get_workbook_hash():
+        return None
+    return entry["etag"]
+
+def download_remote_workbook(backend):
+    """جلب مشروط من مصدر المزامنة: يُرجع RemoteFile، أو None إذا لم يتغير الملف منذ آخر جلب"""
+    return backend.fetch(conditional_etag(backend.key))
+
 def fetch_from_github_requests():
-    """تحميل بإستخدام رابط RAW (requests)"""
+    """تحميل الملف من مصدر المزامنة (رابط RAW لـ GitHub) - طلب مشروط بـ ETag لتجنب إعادة التحميل"""
+    backend = get_sync_backend()
     try:
-        response = requests.get(GITHUB_EXCEL_URL, stream=True, timeout=15)
-        response.raise_for_status()
-        with open(APP_CONFIG["LOCAL_FILE"], "wb") as f:
-            shutil.copyfileobj(response.raw, f)
-        # امسح الكاش
-        try:
-            st.cache_data.clear()
-        except:
-            pass
+        remote = download_remote_workbook(backend)
+        if remote is None:
+            st.info(f"ℹ️ الملف على {backend.label} لم يتغير منذ آخر تحديث.")
+            return True
+        # الكاش مرتبط ببصمة المحتوى، فلا حاجة لمسحه (ولا لإعادة الكتابة إذا لم يتغير الملف)
+        if not write_local_workbook(remote.content):
+            st.info(f"ℹ️ الملف على {backend.label} مطابق للملف المحلي.")
+        # آخر sha معروف = النسخة المحملة، فالرفع التالي يُكتب فوقها مباشرة بدون تعارض ودمج
+        get_remote_file_state()[backend.key] = remote.sha
+        save_fetch_meta(backend.key, etag=remote.etag)
+        save_sync_base(remote.content)
         return True
     except Exception as e:
-        st.error(f"⚠ فشل التحديث من GitHub: {e}")
+        st.error(f"⚠ فشل التحديث من {backend.label}: {e}")
         return False
 
 def fetch_from_github_api():
-    """تحميل عبر GitHub API (باستخدام PyGithub token في secrets)"""
-    if not GITHUB_AVAILABLE:
-        return fetch_from_github_requests()
-    
+    """تحميل الملف من مصدر المزامنة (نفس fetch_from_github_requests: جلب مشروط عبر SyncBackend ومفتاح backend.key)"""
+    return fetch_from_github_requests()
+
+# -------------------------------
+# 🗃 لقطة عمودية للملف (Snapshot) حسب بصمة المحتوى
+# -------------------------------
+SNAPSHOT_FORMAT_VERSION = 2
+
+# أكواد أنواع القيم في الأعمدة المختلطة (نص + أرقام + تواريخ ...)
+_TAG_NULL, _TAG_STR, _TAG_INT, _TAG_FLOAT, _TAG_BOOL, _TAG_DATETIME, _TAG_DATE, _TAG_TIME = range(8)
+
+_TAG_DECODERS = {
+    _TAG_STR: str,
+    _TAG_INT: int,
+    _TAG_FLOAT: float,
+    _TAG_BOOL: lambda s: s == "True",
+    _TAG_DATETIME: datetime.fromisoformat,
+    _TAG_DATE: date.fromisoformat,
+    _TAG_TIME: lambda s: datetime.fromisoformat(f"1900-01-01T{s}").time(),
+}
+
+def compute_file_hash(path):
+    """حساب بصمة SHA-256 لمحتوى الملف"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _tag_value(value):
+    """تحديد كود النوع والنص المكافئ لقيمة واحدة في عمود مختلط"""
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return _TAG_NULL, None
+    if isinstance(value, bool):
+        return _TAG_BOOL, str(value)
+    if isinstance(value, (int, np.integer)):
+        return _TAG_INT, str(int(value))
+    if isinstance(value, (float, np.floating)):
+        return _TAG_FLOAT, repr(float(value))
+    if isinstance(value, datetime):
+        return _TAG_DATETIME, value.isoformat()
+    if isinstance(value, date):
+        return _TAG_DATE, value.isoformat()
+    if hasattr(value, "isoformat") and hasattr(value, "hour"):
+        return _TAG_TIME, value.isoformat()
+    return _TAG_STR, str(value)
+
+def _encode_snapshot_column(series):
+    """تحويل عمود إلى مصفوفة Arrow (مع أكواد الأنواع للأعمدة المختلطة)"""
+    if series.dtype != object:
+        return pa.array(series, from_pandas=True), None
+
+    values = series.tolist()
+    if all(isinstance(v, str) or v is None or (not isinstance(v, str) and pd.isna(v)) for v in values):
+        return pa.array([v if isinstance(v, str) else None for v in values], type=pa.string()), None
+
+    tagged = [_tag_value(v) for v in values]
+    tags = pa.array([t for t, _ in tagged], type=pa.uint8())
+    payload = pa.array([s for _, s in tagged], type=pa.string())
+    return payload, tags
+
+def _decode_snapshot_column(payload, tags):
+    """إعادة بناء عمود مختلط من النص وأكواد الأنواع"""
+    texts = np.array(payload.to_pylist(), dtype=object)
+    codes = tags.to_numpy(zero_copy_only=False)
+    decoded = np.full(len(codes), np.nan, dtype=object)
+
+    for tag in np.unique(codes):
+        if tag == _TAG_NULL:
+            continue
+        positions = codes == tag
+        if tag == _TAG_STR:
+            decoded[positions] = texts[positions]
+        elif tag in (_TAG_INT, _TAG_FLOAT):
+            numbers = texts[positions].astype(np.int64 if tag == _TAG_INT else np.float64)
+            decoded[positions] = numbers.tolist()
+        else:
+            decoded[positions] = [_TAG_DECODERS[tag](s) for s in texts[positions]]
+    return pd.Series(decoded, dtype=object)
+
+def _snapshot_path(file_hash, variant):
+    return os.path.join(APP_CONFIG["SNAPSHOT_DIR"], file_hash, variant)
+
+def sheet_content_hash(df):
+    """بصمة محتوى شيت واحد (الأعمدة والقيم) لربط البيانات المشتقة منه بمحتواه"""
+    digest = hashlib.sha256()
+    digest.update(json.dumps([str(c) for c in df.columns], ensure_ascii=False).encode("utf-8"))
+    if df.shape[1] > 0:
+        digest.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+    return digest.hexdigest()
+
+def save_sheets_snapshot(file_hash, sheets, variant="typed", sheet_hashes=None):
+    """حفظ الشيتات كلقطة Feather (ملف لكل شيت) مع ملف وصف manifest.json"""
+    if not PYARROW_AVAILABLE:
+        return False
+
+    target = _snapshot_path(file_hash, variant)
+    if load_snapshot_manifest(file_hash, variant) is not None:
+        return True
+    # لقطة بإصدار تنسيق قديم أو غير مكتملة
+    shutil.rmtree(target, ignore_errors=True)
+
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(dir=os.path.dirname(target), prefix=os.path.basename(target) + ".tmp-")
     try:
-        token = st.secrets.get("github", {}).get("token", None)
-        if not token:
-            return fetch_from_github_requests()
-        
-        g = Github(token)
-        repo = g.get_repo(APP_CONFIG["REPO_NAME"])
-        file_content = repo.get_contents(APP_CONFIG["FILE_PATH"], ref=APP_CONFIG["BRANCH"])
-        content = b64decode(file_content.content)
-        with open(APP_CONFIG["LOCAL_FILE"], "wb") as f:
-            f.write(content)
-        try:
-            st.cache_data.clear()
-        except:
-            pass
+        manifest = {"format": SNAPSHOT_FORMAT_VERSION, "source_hash": file_hash, "sheets": []}
+
+        for i, (name, df) in enumerate(sheets.items()):
+            arrays, names, columns = [], [], []
+            for j, col in enumerate(df.columns):
+                payload, tags = _encode_snapshot_column(df.iloc[:, j])
+                arrays.append(payload)
+                names.append(f"c{j}")
+                if tags is not None:
+                    arrays.append(tags)
+                    names.append(f"t{j}")
+                columns.append({"name": col, "object": df.iloc[:, j].dtype == object, "tagged": tags is not None})
+
+            file_name = f"{i}.feather"
+            table = pa.Table.from_arrays(arrays, names=names) if arrays else pa.table({})
+            feather.write_feather(table, os.path.join(tmp_dir, file_name), compression="uncompressed")
+            manifest["sheets"].append({
+                "name": name,
+                "file": file_name,
+                "rows": len(df),
+                "columns": columns,
+                "hash": (sheet_hashes or {}).get(name) or sheet_content_hash(df),
+            })
+
+        with open(os.path.join(tmp_dir, "manifest.json"), "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False)
+
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.replace(tmp_dir, target)
         return True
-    except Exception as e:
-        st.error(f"⚠ فشل تحميل الملف من GitHub: {e}")
+    except Exception:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
         return False
 
-# -------------------------------
-# 📂 تحميل الشيتات (مخبأ) - معدل لقراءة جميع الشيتات
-# -------------------------------
-@st.cache_data(show_spinner=False)
-def load_all_sheets():
-    """تحميل جميع الشيتات من ملف Excel"""
-    if not os.path.exists(APP_CONFIG["LOCAL_FILE"]):
+def _snapshot_table_to_frame(table, sheet_meta, start=0):
+    """تحويل جدول Arrow (أو جزء منه) إلى DataFrame بأسماء وأنواع الأعمدة الأصلية"""
+    data = {}
+    for j, col in enumerate(sheet_meta["columns"]):
+        payload = table.column(f"c{j}")
+        if col["tagged"]:
+            series = _decode_snapshot_column(payload, table.column(f"t{j}"))
+        else:
+            series = payload.to_pandas()
+            if col["object"]:
+                series = series.astype(object)
+        data[j] = series
+
+    df = pd.DataFrame(data, index=pd.RangeIndex(table.num_rows))
+    df.index = pd.RangeIndex(start, start + table.num_rows)
+    df.columns = [col["name"] for col in sheet_meta["columns"]]
+    return df
+
+def _open_snapshot_table(base_dir, sheet_meta):
+    return feather.read_table(os.path.join(base_dir, sheet_meta["file"]), memory_map=True)
+
+def _read_snapshot_sheet(base_dir, sheet_meta):
+    """قراءة شيت واحد من اللقطة"""
+    return _snapshot_table_to_frame(_open_snapshot_table(base_dir, sheet_meta), sheet_meta)
+
+def iter_snapshot_sheet_chunks(base_dir, sheet_meta, chunk_rows):
+    """قراءة شيت من اللقطة على دفعات (بدون تحميل الشيت كاملاً في الذاكرة)"""
+    table = _open_snapshot_table(base_dir, sheet_meta)
+    for start in range(0, table.num_rows, chunk_rows):
+        yield _snapshot_table_to_frame(table.slice(start, chunk_rows), sheet_meta, start)
+
+def load_snapshot_manifest(file_hash, variant="typed"):
+    """قراءة ملف وصف اللقطة (None إذا لم تكن موجودة أو بإصدار مختلف)"""
+    if not PYARROW_AVAILABLE:
         return None
-    
+
+    manifest_path = os.path.join(_snapshot_path(file_hash, variant), "manifest.json")
+    if not os.path.exists(manifest_path):
+        return None
+
     try:
-        # قراءة جميع الشيتات
-        sheets = pd.read_excel(APP_CONFIG["LOCAL_FILE"], sheet_name=None)
-        
-        if not sheets:
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        if manifest.get("format") != SNAPSHOT_FORMAT_VERSION:
             return None
-        
-        # تنظيف أسماء الأعمدة لكل شيت
-        for name, df in sheets.items():
-            df.columns = df.columns.astype(str).str.strip()
-        
-        return sheets
-    except Exception as e:
+        return manifest
+    except Exception:
         return None
 
-# نسخة مع dtype=object لواجهة التحرير
-@st.cache_data(show_spinner=False)
-def load_sheets_for_edit():
-    """تحميل جميع الشيتات للتحرير"""
-    if not os.path.exists(APP_CONFIG["LOCAL_FILE"]):
+def load_sheets_snapshot(file_hash, variant="typed"):
+    """تحميل الشيتات من اللقطة إن وجدت (None إذا لم تكن موجودة أو تالفة)"""
+    manifest = load_snapshot_manifest(file_hash, variant)
+    if manifest is None:
         return None
-    
+
     try:
-        # قراءة جميع الشيتات مع dtype=object للحفاظ على تنسيق البيانات
-        sheets = pd.read_excel(APP_CONFIG["LOCAL_FILE"], sheet_name=None, dtype=object)
-        
-        if not sheets:
-            return None
-        
-        # تنظيف أسماء الأعمدة لكل شيت
-        for name, df in sheets.items():
-            df.columns = df.columns.astype(str).str.strip()
-        
-        return sheets
-    except Exception as e:
+        base_dir = _snapshot_path(file_hash, variant)
+        return {meta["name"]: _read_snapshot_sheet(base_dir, meta) for meta in manifest["sheets"]}
+    except Exception:
+        return None
+
+def prune_snapshots(keep_hash):
+    """حذف اللقطات القديمة والإبقاء على أحدثها فقط"""
+    root = APP_CONFIG["SNAPSHOT_DIR"]
+    if not os.path.isdir(root):
+        return
+
+    entries = []
+    for name in os.listdir(root):
+        path = os.path.join(root, name)
+        if name != keep_hash and os.path.isdir(path):
+            entries.append((os.path.getmtime(path), path))
+
+    for _, path in sorted(entries, reverse=True)[max(APP_CONFIG["SNAPSHOT_KEEP"] - 1, 0):]:
+        shutil.rmtree(path, ignore_errors=True)
+
+XLSX_MAIN_NS = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+
+def read_xlsx_sheet_names(path):
+    """قراءة أسماء الشيتات بترتيبها من xl/workbook.xml مباشرة (بدون تحميل البيانات)"""
+    with zipfile.ZipFile(path) as zf:
+        root = ET.fromstring(zf.read("xl/workbook.xml"))
+    return [sheet.get("name") for sheet in root.iter(f"{{{XLSX_MAIN_NS}}}sheet")]
+
+def _parse_workbook_parallel(path, workers):
+    """توزيع قراءة الشيتات على عدة عمليات ثم إعادة تجميعها بنفس الترتيب"""
+    sheet_names = read_xlsx_sheet_names(path)
+    workers = min(workers, len(sheet_names))
+    if workers <= 1:
         return None
 
+    # كل عملية تقرأ مجموعة من الشيتات (فتح الملف مرة واحدة لكل عملية)
+    # spawn وليس fork: نسخ عملية الخادم بخيوطها وأقفالها قد يعلّق العمليات الجديدة،
+    # والدالة المرسلة pd.read_excel تُستورد في العملية الجديدة بدون تشغيل التطبيق
+    groups = [sheet_names[i::workers] for i in range(workers)]
+    parsed = {}
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        futures = [pool.submit(pd.read_excel, path, sheet_name=group, dtype=object) for group in groups]
+        for future in futures:
+            parsed.update(future.result())
+    return {name: parsed[name] for name in sheet_names}
+
+def parse_workbook(path):
+    """قراءة جميع الشيتات (dtype=object) من ملف Excel - على التوازي للملفات الكبيرة"""
+    sheets = None
+    workers = APP_CONFIG["PARSE_WORKERS"] or os.cpu_count() or 1
+    if workers > 1 and os.path.getsize(path) >= APP_CONFIG["PARALLEL_PARSE_MIN_BYTES"]:
+        try:
+            sheets = _parse_workbook_parallel(os.path.abspath(path), workers)
+        except Exception:
+            # تعذر تشغيل العمليات أو فشل إحداها: قراءة عادية
+            sheets = None
+
+    if sheets is None:
+        sheets = pd.read_excel(path, sheet_name=None, dtype=object)
+
+    # تنظيف أسماء الأعمدة لكل شيت
+    for name, df in sheets.items():
+        df.columns = df.columns.astype(str).str.strip()
+
+    return sheets
+
+def read_workbook(variant="object", path=None):
+    """قراءة جميع الشيتات من اللقطة إن كانت مطابقة لبصمة الملف، وإلا من Excel (مرة واحدة) ثم حفظ لقطة جديدة
+
+    variant: "object" لنسخة التحرير (dtype=object) أو "typed" لنسخة العرض (أنواع مستنتجة).
+    path: ملف آخر غير الملف المحلي (مثل نسخة جديدة قبل استبدال الملف بها).
+    """
+    path = path or APP_CONFIG["LOCAL_FILE"]
+    file_hash = compute_file_hash(path)
+
+    sheets = load_sheets_snapshot(file_hash, variant)
+    if sheets is not None:
+        return sheets
+
+    raw_sheets = load_sheets_snapshot(file_hash, "object") if variant != "object" else None
+    if raw_sheets is None:
+        raw_sheets = parse_workbook(path)
+        if not raw_sheets:
+            return raw_sheets
+        save_sheets_snapshot(file_hash, raw_sheets, "object")
+
+    # بصمات الشيتات تُحسب من نسخة dtype=object حتى تكون واحدة في النسختين
+    manifest = load_snapshot_manifest(file_hash, "object")
+    sheet_hashes = {meta["name"]: meta["hash"] for meta in manifest["sheets"]} if manifest else None
+
+    sheets = raw_sheets if variant == "object" else derive_typed_view(raw_sheets)
+    save_sheets_snapshot(file_hash, sheets, variant, sheet_hashes)
+    prune_snapshots(file_hash)
+    return sheets
+
+def infer_sheet_types(df):
+    """استنتاج أنواع الأعمدة من نسخة dtype=object بنفس طريقة read_excel (بدون إعادة قراءة الملف)"""
+    if df.shape[1] == 0:
+        return df
+
+    rows = df.to_numpy(dtype=object).tolist()
+    typed = TextParser(rows, names=list(range(df.shape[1])), header=None, skip_blank_lines=False).read()
+
+    # الأعمدة التي بقيت object تُشارك نفس البيانات بدلاً من نسخها
+    columns = {
+        j: df.iloc[:, j] if typed.dtypes.iloc[j] == object else typed.iloc[:, j]
+        for j in range(df.shape[1])
+    }
+    result = pd.DataFrame(columns, copy=False)
+    result.columns = df.columns
+    return result
+
+def derive_typed_view(sheets_edit):
+    """اشتقاق نسخة العرض والتحليل (أنواع مستنتجة) من نسخة التحرير"""
+    return {name: infer_sheet_types(df) for name, df in sheets_edit.items()}
+
 # -------------------------------
-# 🔁 حفظ محلي + رفع على GitHub + مسح الكاش + إعادة تحميل
+# 💤 تحميل كسول للشيتات (شيت واحد عند أول طلب)
 # -------------------------------
-def save_local_excel_and_push(sheets_dict, commit_message="Update from Streamlit"):
-    """دالة محسنة للحفظ التلقائي المحلي والرفع إلى GitHub"""
-    # احفظ محلياً
+@st.cache_data(show_spinner=False, max_entries=4)
+def _cached_file_hash(path, mtime_ns, size):
+    return compute_file_hash(path)
+
+def get_workbook_hash():
+    """بصمة الملف المحلي الحالية (تُحسب مرة واحدة لكل تعديل على الملف)"""
+    stat = os.stat(APP_CONFIG["LOCAL_FILE"])
+    return _cached_file_hash(APP_CONFIG["LOCAL_FILE"], stat.st_mtime_ns, stat.st_size)
+
+class LazyWorkbook(Mapping):
+    """واجهة قاموس {اسم الشيت: DataFrame} للقراءة فقط تقرأ كل شيت عند أول طلب فقط
+
+    تُقرأ الشيتات من اللقطة العمودية (memory-mapped) إن وجدت، وإلا من ملف Excel مفتوح بوضع
+    القراءة فقط، مع الاحتفاظ بآخر الشيتات المستخدمة فقط (LRU). نسخة واحدة لكل إصدار من الملف
+    مشتركة بين كل الجلسات بدون نسخ، لذلك لا يجب تعديل الـ DataFrames المُرجعة في مكانها.
+    """
+
+    def __init__(self, path, file_hash, cache_size):
+        self.path = path
+        self.file_hash = file_hash
+        self.cache_size = cache_size
+        self._lock = threading.RLock()
+        self._cache = OrderedDict()
+        self._hashes = {}
+        self._columns = {}
+        self._excel = None
+        manifest = load_snapshot_manifest(file_hash, "typed")
+        self.from_snapshot = manifest is not None
+
+        if self.from_snapshot:
+            self._sheet_meta = {meta["name"]: meta for meta in manifest["sheets"]}
+            self._hashes = {name: meta["hash"] for name, meta in self._sheet_meta.items()}
+            self._names = list(self._sheet_meta)
+        else:
+            self._sheet_meta = {}
+            self._excel = pd.ExcelFile(path, engine="openpyxl")
+            self._names = list(self._excel.sheet_names)
+
+    def __getitem__(self, name):
+        with self._lock:
+            if name in self._cache:
+                self._cache.move_to_end(name)
+                return self._cache[name]
+            if name not in self._names:
+                raise KeyError(name)
+
+            df = self._load_sheet(name)
+            self._cache[name] = df
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+            return df
+
+    def __iter__(self):
+        return iter(self._names)
+
+    def __len__(self):
+        return len(self._names)
+
+    def __contains__(self, name):
+        return name in self._names
+
+    @property
+    def version(self):
+        """إصدار اللقطة (بصمة محتوى الملف)"""
+        return self.file_hash
+
+    def _load_sheet(self, name):
+        if not self.from_snapshot:
+            # ربما اكتمل بناء اللقطة في الخلفية منذ فتح الملف
+            manifest = load_snapshot_manifest(self.file_hash, "typed")
+            if manifest is not None:
+                self._sheet_meta = {meta["name"]: meta for meta in manifest["sheets"]}
+                self._hashes.update({name: meta["hash"] for name, meta in self._sheet_meta.items()})
+                self.from_snapshot = True
+                self._excel.close()
+                self._excel = None
+
+        if name in self._sheet_meta:
+            return _read_snapshot_sheet(_snapshot_path(self.file_hash, "typed"), self._sheet_meta[name])
+
+        df = self._excel.parse(name, dtype=object)
+        df.columns = df.columns.astype(str).str.strip()
+        self._hashes[name] = sheet_content_hash(df)
+        return infer_sheet_types(df)
+
+    def sheet_columns(self, name):
+        """أسماء أعمدة الشيت بدون تحميل بياناته (من اللقطة، أو من صف العناوين فقط في ملف Excel)"""
+        with self._lock:
+            if name not in self._columns:
+                if name not in self._names:
+                    raise KeyError(name)
+                meta = self._sheet_meta.get(name)
+                if meta is not None:
+                    columns = [column["name"] for column in meta["columns"]]
+                elif name in self._cache:
+                    columns = list(self._cache[name].columns)
+                elif self._excel is not None:
+                    columns = list(self._excel.parse(name, nrows=0, dtype=object).columns.astype(str).str.strip())
+                else:
+                    columns = list(self[name].columns)
+                self._columns[name] = columns
+            return self._columns[name]
+
+    def sheet_hash(self, name):
+        """بصمة محتوى الشيت (تبقى ثابتة ما دام محتوى الشيت لم يتغير حتى لو تغير باقي الملف)"""
+        with self._lock:
+            if name not in self._hashes:
+                self[name]
+            return self._hashes[name]
+
+    def iter_chunks(self, name, chunk_rows):
+        """قراءة شيت على دفعات من اللقطة مباشرة (أو الشيت كاملاً إن لم توجد لقطة)"""
+        if name not in self._names:
+            raise KeyError(name)
+
+        with self._lock:
+            cached = self._cache.get(name)
+        if cached is not None or name not in self._sheet_meta:
+            yield cached if cached is not None else self[name]
+            return
+
+        yield from iter_snapshot_sheet_chunks(_snapshot_path(self.file_hash, "typed"), self._sheet_meta[name], chunk_rows)
+
+    def loaded_sheets(self):
+        """أسماء الشيتات المحملة حالياً في الذاكرة"""
+        with self._lock:
+            return list(self._cache)
+
+@st.cache_resource(show_spinner=False, max_entries=2)
+def _open_lazy_workbook(file_hash):
+    workbook = LazyWorkbook(APP_CONFIG["LOCAL_FILE"], file_hash, APP_CONFIG["LAZY_SHEET_CACHE_SIZE"])
+    if not workbook.from_snapshot:
+        # بناء اللقطة في الخلفية حتى تصبح القراءات التالية من اللقطة
+        threading.Thread(target=read_workbook, args=("typed",), daemon=True).start()
+    return workbook
+
+def get_lazy_workbook():
+    """الحصول على واجهة التحميل الكسول للملف الحالي (None إذا لم يكن الملف موجوداً)"""
+    if not os.path.exists(APP_CONFIG["LOCAL_FILE"]):
+        return None
     try:
-        with pd.ExcelWriter(APP_CONFIG["LOCAL_FILE"], engine="openpyxl") as writer:
-            for name, sh in sheets_dict.items():
-                try:
-                    sh.to_excel(writer, sheet_name=name, index=False)
-                except Exception:
-                    sh.astype(object).to_excel(writer, sheet_name=name, index=False)
-    except Exception as e:
-        st.error(f"⚠ خطأ أثناء الحفظ المحلي: {e}")
+        return _open_lazy_workbook(get_workbook_hash())
+    except Exception:
         return None
 
-    # امسح الكاش
-    try:
-        st.cache_data.clear()
-    except:
-        pass
+# -------------------------------
+# 📝 سجل الأحداث الجديدة (إضافة فقط) فوق الملف
+# -------------------------------
+class EventJournal:
+    """سجل JSONL للأحداث المضافة: الإضافة سطر واحد في آخر الملف بدلاً من إعادة كتابة ملف Excel"""
 
-    # حاول الرفع عبر PyGithub token في secrets
-    token = st.secrets.get("github", {}).get("token", None)
-    if not token:
-        st.warning("⚠ لم يتم العثور على GitHub token. سيتم الحفظ محلياً فقط.")
-        return load_sheets_for_edit()
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.RLock()
+        self._counter = 0
+        self._entries = self._read()
+        # يتغير مع كل إضافة/حذف (مفتاح للكاش)
+        self.version = 0
 
-    if not GITHUB_AVAILABLE:
-        st.warning("⚠ PyGithub غير متوفر. سيتم الحفظ محلياً فقط.")
-        return load_sheets_for_edit()
+    def _read(self):
+        if not os.path.exists(self.path):
+            return []
+        entries = []
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entries.append(json.loads(line))
+                except json.JSONDecodeError:
+                    # سطر غير مكتمل (توقف أثناء الكتابة)
+                    continue
+        return entries
 
-    try:
-        g = Github(token)
-        repo = g.get_repo(APP_CONFIG["REPO_NAME"])
-        with open(APP_CONFIG["LOCAL_FILE"], "rb") as f:
-            content = f.read()
+    def append(self, sheet_name, row, username):
+        """إضافة حدث (صف جديد لشيت) وحفظه على القرص فوراً"""
+        with self._lock:
+            self._counter += 1
+            entry = {
+                "id": f"{time.time_ns()}-{self._counter}",
+                "sheet": sheet_name,
+                "row": row,
+                "user": username,
+                "time": datetime.now().isoformat(timespec="seconds"),
+            }
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            self._entries.append(entry)
+            self.version += 1
+            return entry
 
-        try:
-            contents = repo.get_contents(APP_CONFIG["FILE_PATH"], ref=APP_CONFIG["BRANCH"])
-            result = repo.update_file(path=APP_CONFIG["FILE_PATH"], message=commit_message, content=content, sha=contents.sha, branch=APP_CONFIG["BRANCH"])
-            st.success(f"✅ تم الحفظ والرفع إلى GitHub بنجاح: {commit_message}")
-            return load_sheets_for_edit()
-        except Exception as e:
-            # حاول رفع كملف جديد أو إنشاء
-            try:
-                result = repo.create_file(path=APP_CONFIG["FILE_PATH"], message=commit_message, content=content, branch=APP_CONFIG["BRANCH"])
-                st.success(f"✅ تم إنشاء ملف جديد على GitHub: {commit_message}")
-                return load_sheets_for_edit()
-            except Exception as create_error:
-                st.error(f"❌ فشل إنشاء ملف جديد على GitHub: {create_error}")
-                return None
+    def entries(self):
+        with self._lock:
+            return list(self._entries)
 
-    except Exception as e:
-        st.error(f"❌ فشل الرفع إلى GitHub: {e}")
-        return None
+    def remove(self, ids):
+        """حذف الأحداث التي دُمجت في الملف (إعادة كتابة ذرية للسجل)"""
+        ids = set(ids)
+        with self._lock:
+            remaining = [entry for entry in self._entries if entry["id"] not in ids]
+            if len(remaining) == len(self._entries):
+                return
+            if remaining:
+                tmp_path = temp_path_beside(self.path)
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    f.writelines(json.dumps(entry, ensure_ascii=False) + "\n" for entry in remaining)
+                os.replace(tmp_path, self.path)
+            elif os.path.exists(self.path):
+                os.remove(self.path)
+            self._entries = remaining
+            self.version += 1
 
-def auto_save_to_github(sheets_dict, operation_description):
-    """دالة الحفظ التلقائي المحسنة"""
-    username = st.session_state.get("username", "unknown")
-    commit_message = f"{operation_description} by {username} at {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
-    
-    result = save_local_excel_and_push(sheets_dict, commit_message)
-    if result is not None:
-        st.success("✅ تم حفظ التغييرات تلقائياً في GitHub")
-        return result
-    else:
-        st.error("❌ فشل الحفظ التلقائي")
-        return sheets_dict
+    def oldest_age_seconds(self):
+        with self._lock:
+            if not self._entries:
+                return 0
+            return (datetime.now() - datetime.fromisoformat(self._entries[0]["time"])).total_seconds()
+
+@st.cache_resource(show_spinner=False)
+def get_event_journal():
+    return EventJournal(APP_CONFIG["EVENT_JOURNAL_FILE"])
+
+def fold_journal_entries(sheets, entries):
+    """إضافة صفوف السجل إلى نهاية شيتاتها (قاموس جديد، بدون تعديل الأصل)"""
+    rows_by_sheet = {}
+    for entry in entries:
+        rows_by_sheet.setdefault(entry["sheet"], []).append(entry["row"])
+
+    folded = dict(sheets)
+    for sheet_name, rows in rows_by_sheet.items():
+        new_rows = pd.DataFrame(rows, dtype=object)
+        if sheet_name in folded:
+            new_rows = pd.concat([folded[sheet_name].astype(object), new_rows], ignore_index=True)
+        folded[sheet_name] = new_rows.astype(object)
+    return folded
+
+class JournaledWorkbook(Mapping):
+    """واجهة للقراءة فقط تعرض الملف مع أحداث السجل التي لم تُدمج فيه بعد (نفس واجهة LazyWorkbook)"""
+
+    def __init__(self, base, entries):
+        self.base = base
+        self.file_hash = base.file_hash
+        self._lock = threading.RLock()
+        self._cache = {}
+        self._rows = {}
+        for entry in entries:
+            self._rows.setdefault(entry["sheet"], []).append(entry["row"])
+        self._journal_hash = hashlib.sha256(
+            json.dumps([entry["id"] for entry in entries]).encode("utf-8")
+        ).hexdigest()
+
+    def __getitem__(self, name):
+        if name not in self._rows:
+            return self.base[name]
+        with self._lock:
+            if name not in self._cache:
+                raw = self.base[name].astype(object) if name in self.base else pd.DataFrame()
+                raw = fold_journal_entries({name: raw}, [{"sheet": name, "row": row} for row in self._rows[name]])[name]
+                self._cache[name] = infer_sheet_types(raw)
+            return self._cache[name]
+
+    def __iter__(self):
+        yield from self.base
+        yield from (name for name in self._rows if name not in self.base)
+
+    def __len__(self):
+        return len(self.base) + sum(1 for name in self._rows if name not in self.base)
+
+    def __contains__(self, name):
+        return name in self.base or name in self._rows
+
+    @property
+    def version(self):
+        return f"{self.base.version}+{self._journal_hash}"
+
+    def sheet_columns(self, name):
+        """أعمدة الشيت في الملف ثم أعمدة صفوف السجل الجديدة (نفس ترتيب fold_journal_entries) بدون تحميل الشيت"""
+        if name not in self:
+            raise KeyError(name)
+        columns = list(self.base.sheet_columns(name)) if name in self.base else []
+        for row in self._rows.get(name, ()):
+            for key in row:
+                if key not in columns:
+                    columns.append(key)
+        return columns
+
+    def sheet_hash(self, name):
+        base_hash = self.base.sheet_hash(name) if name in self.base else ""
+        if name not in self._rows:
+            return base_hash
+        payload = json.dumps(self._rows[name], sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(f"{base_hash}|{payload}".encode("utf-8")).hexdigest()
+
+    def iter_chunks(self, name, chunk_rows):
+        if name in self._rows:
+            yield self[name]
+        else:
+            yield from self.base.iter_chunks(name, chunk_rows)
+
+    def loaded_sheets(self):
+        return self.base.loaded_sheets() + [name for name in self._cache if name not in self.base.loaded_sheets()]
+
+@st.cache_resource(show_spinner=False, max_entries=2)
+def _open_journaled_workbook(file_hash, journal_version):
+    return JournaledWorkbook(_open_lazy_workbook(file_hash), get_event_journal().entries())
+
+def compact_event_journal():
+    """دمج أحداث السجل في ملف Excel (الشيتات المعدلة فقط) وإضافة التعديل لطابور الرفع
+
+    تُرجع عدد الأحداث التي دُمجت. لا تستخدم st حتى يمكن تشغيلها من خيط في الخلفية.
+    """
+    journal = get_event_journal()
+    worker = _get_sync_worker()
+    with worker.file_lock:
+        entries = journal.entries()
+        if not entries:
+            return 0
+        write_local_sheets(fold_journal_entries(read_workbook("object"), entries))
+        journal.remove(entry["id"] for entry in entries)
+
+        # داخل القفل: الأحداث حُذفت من السجل، فلا يجب أن يُستبدل الملف قبل أن تُسجل في الطابور
+        if worker.backend:
+            users = sorted({entry["user"] for entry in entries})
+            sheets = sorted({entry["sheet"] for entry in entries})
+            worker.enqueue(f"إضافة {len(entries)} حدث جديد في {', '.join(sheets)} by {', '.join(users)}", ", ".join(users))
+    return len(entries)
+
+def maybe_compact_event_journal():
+    """دمج السجل إذا تجاوز الحد المسموح من الأحداث أو من الوقت"""
+    journal = get_event_journal()
+    entries = journal.entries()
+    if not entries:
+        return 0
+    if len(entries) >= APP_CONFIG["JOURNAL_COMPACT_ROWS"] or journal.oldest_age_seconds() >= APP_CONFIG["JOURNAL_COMPACT_SECONDS"]:
+        return compact_event_journal()
+    return 0
+
+# -------------------------------
+# 📂 تحميل الشيتات - لقطة مشتركة للعرض ونسخ قابلة للتعديل للتحرير فقط
+# -------------------------------
+def load_all_sheets():
+    """تحميل جميع الشيتات من ملف Excel (لقطة للقراءة فقط مشتركة بين كل الجلسات بدون نسخ)
+
+    مع إضافة أحداث السجل التي لم تُدمج في الملف بعد.
+    """
+    workbook = get_lazy_workbook()
+    journal = get_event_journal()
+    if workbook is None or not journal.entries():
+        return workbook
+    return _open_journaled_workbook(workbook.file_hash, journal.version)
+
+# نسخة مع dtype=object لواجهة التحرير (st.cache_data يُرجع نسخة مستقلة قابلة للتعديل لكل استدعاء)
+@st.cache_data(show_spinner=False, max_entries=2)
+def _load_sheets_for_edit(file_hash):
+    try:
+        # قراءة جميع الشيتات مع dtype=object للحفاظ على تنسيق البيانات
+        # (من اللقطة العمودية إن كان الملف لم يتغير)
+        sheets = read_workbook("object")
+
+        if not sheets:
+            return None
+
+        return sheets
+    except Exception as e:
+        return None
+
+def load_sheets_for_edit():
+    """تحميل جميع الشيتات للتحرير (مخبأ حسب بصمة محتوى الملف) مع أحداث السجل"""
+    if not os.path.exists(APP_CONFIG["LOCAL_FILE"]):
+        return None
+    sheets = _load_sheets_for_edit(get_workbook_hash())
+
+    # الأحداث المعروضة هنا ستُحفظ ضمن الشيتات عند أي حفظ من واجهة التحرير
+    entries = get_event_journal().entries()
+    st.session_state["journal_folded_ids"] = [entry["id"] for entry in entries]
+    if sheets is None or not entries:
+        return sheets
+    return fold_journal_entries(sheets, entries)
+
+
+# -------------------------------
+# 🗄 نسخة SQLite مفهرسة من الملف (اختيارية)
+# -------------------------------
+def _sqlite_value(value):
+    """تحويل قيمة خلية إلى قيمة JSON (الفارغ = null) مع الحفاظ على نوعها"""
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return None
+    if hasattr(value, "item"):
+        return value.item()
+    return value
+
+def _sqlite_number(value):
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    return None if np.isnan(number) else number
+
+class SQLiteStore:
+    """نسخة من الشيتات في SQLite مع فهارس على الماكينة والتاريخ والفني ونطاق الأطنان وبحث نصي trigram
+
+    تُحدَّث الشيتات التي تغيرت بصمتها فقط، وتُستخدم كل الجلسات نفس الاتصال (مع قفل).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.RLock()
+        self._version = None
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS sheets (
+                name TEXT PRIMARY KEY, hash TEXT, position INTEGER, card INTEGER, columns_json TEXT
+            );
+            CREATE TABLE IF NOT EXISTS rows (
+                id INTEGER PRIMARY KEY,
+                sheet TEXT, row_idx INTEGER, card INTEGER,
+                min_tones REAL, max_tones REAL, has_range INTEGER,
+                tech TEXT, tech_lower TEXT, date_lower TEXT,
+                event_lower TEXT, correction_lower TEXT, text TEXT,
+                result_json TEXT, data_json TEXT
+            );
+            CREATE UNIQUE INDEX IF NOT EXISTS rows_sheet_row ON rows(sheet, row_idx);
+            CREATE INDEX IF NOT EXISTS rows_card ON rows(card);
+            CREATE INDEX IF NOT EXISTS rows_date ON rows(date_lower);
+            CREATE INDEX IF NOT EXISTS rows_tech ON rows(tech_lower);
+            CREATE INDEX IF NOT EXISTS rows_tonnage ON rows(sheet, min_tones, max_tones);
+            CREATE TABLE IF NOT EXISTS plan (
+                idx INTEGER PRIMARY KEY, min_tones REAL, max_tones REAL, data_json TEXT
+            );
+            CREATE INDEX IF NOT EXISTS plan_tonnage ON plan(min_tones, max_tones);
+        """)
+        try:
+            self._conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS rows_fts USING fts5(text, tokenize='trigram')")
+            self.fts = True
+        except sqlite3.OperationalError:
+            # SQLite أقدم من 3.34 (بدون trigram): البحث النصي بـ instr فقط
+            self.fts = False
+
+    def sync(self, workbook):
+        """مزامنة النسخة مع الملف (الشيتات التي تغيرت بصمتها فقط)"""
+        with self._lock:
+            if self._version == workbook.version:
+                return
+            stored = dict(self._conn.execute("SELECT name, hash FROM sheets"))
+            names = list(workbook.keys())
+            with self._conn:
+                for position, name in enumerate(names):
+                    sheet_hash = workbook.sheet_hash(name)
+                    if stored.get(name) == sheet_hash:
+                        self._conn.execute("UPDATE sheets SET position = ? WHERE name = ?", (position, name))
+                    else:
+                        self._replace_sheet(name, sheet_hash, position, workbook[name])
+                for name in set(stored) - set(names):
+                    self._delete_sheet(name)
+            self._version = workbook.version
+
+    def _delete_sheet(self, name):
+        if self.fts:
+            self._conn.execute("DELETE FROM rows_fts WHERE rowid IN (SELECT id FROM rows WHERE sheet = ?)", (name,))
+        self._conn.execute("DELETE FROM rows WHERE sheet = ?", (name,))
+        self._conn.execute("DELETE FROM sheets WHERE name = ?", (name,))
+        if name == "ServicePlan":
+            self._conn.execute("DELETE FROM plan")
+
+    def _replace_sheet(self, name, sheet_hash, position, df):
+        self._delete_sheet(name)
+        card_match = re.search(r'Card(\d+)', name)
+        card_num = int(card_match.group(1)) if card_match else None
+        columns = [str(c) for c in df.columns]
+        self._conn.execute(
+            "INSERT INTO sheets (name, hash, position, card, columns_json) VALUES (?, ?, ?, ?, ?)",
+            (name, sheet_hash, position, card_num, json.dumps(columns, ensure_ascii=False)),
+        )
+
+        if name == "ServicePlan":
+            self._conn.executemany(
+                "INSERT INTO plan (idx, min_tones, max_tones, data_json) VALUES (?, ?, ?, ?)",
+                [
+                    (i, _sqlite_number(row.get("Min_Tones")), _sqlite_number(row.get("Max_Tones")),
+                     json.dumps([_sqlite_value(v) for v in row.tolist()], ensure_ascii=False, default=str))
+                    for i, (_, row) in enumerate(df.iterrows())
+                ],
+            )
+            return
+
+        has_min, has_max = "Min_Tones" in df.columns, "Max_Tones" in df.columns
+        roles = column_roles(df.columns)
+        records = []
+        for i, (_, row) in enumerate(df.iterrows()):
+            min_value = row["Min_Tones"] if has_min else None
+            max_value = row["Max_Tones"] if has_max else None
+            has_range = has_min and has_max and pd.notna(min_value) and pd.notna(max_value) \
+                and min_value != "" and max_value != ""
+            tech = get_servised_by_value(row, roles)
+            date_lower = str(row.get("Date", "")).strip().lower() if pd.notna(row.get("Date")) else ""
+            event, correction = extract_event_correction(row, df, roles)
+            result = extract_row_data(row, df, card_num, roles) if card_num is not None else None
+            records.append((
+                name, i, card_num,
+                _sqlite_number(min_value), _sqlite_number(max_value), int(bool(has_range)),
+                tech, tech.lower(), date_lower,
+                event.lower(), correction.lower(), f"{event.lower()} {correction.lower()}",
+                json.dumps(result, ensure_ascii=False) if result else None,
+                json.dumps([_sqlite_value(v) for v in row.tolist()], ensure_ascii=False, default=str),
+            ))
+        self._conn.executemany(
+            "INSERT INTO rows (sheet, row_idx, card, min_tones, max_tones, has_range, tech, tech_lower, date_lower, "
+            "event_lower, correction_lower, text, result_json, data_json) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            records,
+        )
+        if self.fts:
+            self._conn.execute("INSERT INTO rows_fts (rowid, text) SELECT id, text FROM rows WHERE sheet = ?", (name,))
+
+    def _columns(self, sheet_name):
+        row = self._conn.execute("SELECT columns_json FROM sheets WHERE name = ?", (sheet_name,)).fetchone()
+        return json.loads(row[0]) if row else []
+
+    def _frame(self, sheet_name, data_rows):
+        columns = self._columns(sheet_name)
+        return pd.DataFrame([json.loads(data) for (data,) in data_rows], columns=columns)
+
+    def search_sheet(self, sheet_name, target_techs, target_dates, search_terms, search_params):
+        """نفس نتائج iter_search_matches لشيت ماكينة واحد، باستعلام على الفهارس"""
+        exact = search_params["exact_match"]
+        sql = ["SELECT result_json FROM rows WHERE sheet = ? AND result_json IS NOT NULL"]
+        args = [sheet_name]
+
+        def match_any(column, terms):
+            if exact:
+                args.extend(terms)
+                return f"{column} IN ({', '.join('?' * len(terms))})"
+            args.extend(terms)
+            return "(" + " OR ".join(f"instr({column}, ?) > 0" for _ in terms) + ")"
+
+        if target_techs:
+            sql.append("AND tech_lower != '-' AND " + match_any("tech_lower", target_techs))
+        if target_dates:
+            sql.append("AND date_lower != '' AND " + match_any("date_lower", target_dates))
+        if search_terms:
+            if exact:
+                sql.append(f"AND ({match_any('event_lower', search_terms)} OR {match_any('correction_lower', search_terms)})")
+            else:
+                if self.fts and all(len(term) >= 3 for term in search_terms):
+                    # فلترة أولية بفهرس trigram ثم نفس شرط instr للتطابق التام مع البحث العادي
+                    sql.append("AND id IN (SELECT rowid FROM rows_fts WHERE rows_fts MATCH ?)")
+                    args.append(" OR ".join('"' + term.replace('"', '""') + '"' for term in search_terms))
+                sql.append("AND " + match_any("text", search_terms))
+        sql.append("ORDER BY row_idx")
+
+        with self._lock:
+            return [json.loads(result) for (result,) in self._conn.execute(" ".join(sql), args)]
+
+    def techs(self):
+        """أسماء الفنيين في كل الشيتات (عدا ServicePlan)"""
+        with self._lock:
+            return {tech for (tech,) in self._conn.execute("SELECT DISTINCT tech FROM rows WHERE tech != '-'")}
+
+    def service_rows(self, sheet_name, slice_min, slice_max, require_range):
+        """صفوف الخدمات المتقاطعة مع الشريحة (بفهرس الأطنان)"""
+        if require_range:
+            where = "has_range = 1 AND min_tones <= ? AND max_tones >= ?"
+        else:
+            where = "coalesce(min_tones, 0) <= ? AND coalesce(max_tones, 0) >= ?"
+        with self._lock:
+            data_rows = self._conn.execute(
+                f"SELECT data_json FROM rows WHERE sheet = ? AND {where} ORDER BY row_idx",
+                (sheet_name, float(slice_max), float(slice_min)),
+            ).fetchall()
+            return self._frame(sheet_name, data_rows)
+
+@st.cache_resource(show_spinner=False)
+def _open_sqlite_store(path):
+    return SQLiteStore(path)
+
+def get_sqlite_store(all_sheets):
+    """نسخة SQLite متزامنة مع الشيتات الحالية (None إذا كان مصدر الاستعلامات xlsx)"""
+    if APP_CONFIG["STORAGE_BACKEND"] != "sqlite" or not hasattr(all_sheets, "sheet_hash"):
+        return None
+    store = _open_sqlite_store(APP_CONFIG["SQLITE_FILE"])
+    store.sync(all_sheets)
+    return store
+
+# -------------------------------
+# ✍ كتابة الشيتات المعدلة فقط داخل ملف xlsx
+# -------------------------------
+XLSX_REL_NS = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+XLSX_PKG_REL_NS = "http://schemas.openxmlformats.org/package/2006/relationships"
+
+# أحرف التحكم غير المسموح بها في XML
+_ILLEGAL_XML_CHARS = re.compile(r"[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+# عناصر إعدادات العرض التي تُنسخ من الشيت الأصلي (بالترتيب المطلوب قبل sheetData)
+_KEPT_SHEET_ELEMENTS = ("sheetPr", "sheetViews", "sheetFormatPr", "cols")
+# عناصر تُنسخ بعد sheetData (دمج الخلايا والتنسيق الشرطي وقوائم التحقق، بترتيب المخطط)
+_KEPT_TRAILING_ELEMENTS = ("mergeCells", "conditionalFormatting", "dataValidations")
+
+_XLSX_CELL_TAG = re.compile(r"<c\b[^>]*>")
+_XLSX_CELL_REF = re.compile(r'\br="([A-Z]+\d+)"')
+_XLSX_CELL_STYLE = re.compile(r'\bs="(\d+)"')
+
+class IncrementalWriteUnsupported(Exception):
+    """الحالة لا تسمح بالكتابة الجزئية (يُستخدم الحفظ الكامل بدلاً منها)"""
+
+def _xlsx_column_letter(index):
+    letters = ""
+    index += 1
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(65 + remainder) + letters
+    return letters
+
+def _xlsx_cell_xml(ref, value, style=""):
+    """تحويل قيمة واحدة إلى عنصر <c> (نصوص inline حتى لا يتأثر sharedStrings)"""
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        # خلية فارغة لها تنسيق (حدود، لون) تبقى بتنسيقها
+        return f'<c r="{ref}"{style}/>' if style else ""
+    if isinstance(value, (bool, np.bool_)):
+        return f'<c r="{ref}"{style} t="b"><v>{int(value)}</v></c>'
+    if isinstance(value, (int, float, np.integer, np.floating)):
+        if not np.isfinite(value):
+            return ""
+        return f'<c r="{ref}"{style}><v>{repr(value.item() if hasattr(value, "item") else value)}</v></c>'
+    if isinstance(value, (datetime, date, pd.Timestamp)) or hasattr(value, "hour"):
+        # التواريخ تحتاج تنسيقاً في styles.xml
+        raise IncrementalWriteUnsupported("date cells")
+
+    text = _ILLEGAL_XML_CHARS.sub("", str(value))
+    text = text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+    return f'<c r="{ref}"{style} t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>'
+
+def _xlsx_kept_elements(original, tags):
+    """نسخ عناصر الشيت الأصلي كما هي بالترتيب المعطى (العنصر قد يتكرر مثل conditionalFormatting)"""
+    kept = []
+    for tag in tags:
+        kept.extend(m.group(0) for m in re.finditer(rf"<{tag}\b[^>]*/>|<{tag}\b.*?</{tag}>", original, flags=re.S))
+    return kept
+
+def _xlsx_cell_styles(original):
+    """تنسيق (s=) كل خلية في الشيت الأصلي حسب مرجعها"""
+    styles = {}
+    for tag in _XLSX_CELL_TAG.findall(original):
+        ref, style = _XLSX_CELL_REF.search(tag), _XLSX_CELL_STYLE.search(tag)
+        if ref and style:
+            styles[ref.group(1)] = f' s="{style.group(1)}"'
+    return styles
+
+def build_worksheet_xml(df, original_xml=b""):
+    """بناء XML لشيت واحد من DataFrame مع الاحتفاظ بإعدادات العرض وتنسيق الخلايا من الشيت الأصلي"""
+    original = original_xml.decode("utf-8", errors="ignore")
+    sheet_data = re.search(r"<sheetData\b.*?</sheetData>", original, flags=re.S)
+    styles = _xlsx_cell_styles(sheet_data.group(0)) if sheet_data else {}
+
+    rows = []
+    letters = [_xlsx_column_letter(j) for j in range(df.shape[1])]
+    header_cells = "".join(
+        _xlsx_cell_xml(f"{letters[j]}1", str(col), styles.get(f"{letters[j]}1", "")) for j, col in enumerate(df.columns)
+    )
+    rows.append(f'<row r="1">{header_cells}</row>')
+
+    for i, values in enumerate(df.itertuples(index=False, name=None), start=2):
+        cells = "".join(
+            _xlsx_cell_xml(f"{letters[j]}{i}", v, styles.get(f"{letters[j]}{i}", "")) for j, v in enumerate(values)
+        )
+        rows.append(f'<row r="{i}">{cells}</row>' if cells else f'<row r="{i}"/>')
+
+    return (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        f'<worksheet xmlns="{XLSX_MAIN_NS}" xmlns:r="{XLSX_REL_NS}">'
+        + "".join(_xlsx_kept_elements(original, _KEPT_SHEET_ELEMENTS))
+        + "<sheetData>" + "".join(rows) + "</sheetData>"
+        + "".join(_xlsx_kept_elements(original, _KEPT_TRAILING_ELEMENTS))
+        + "</worksheet>"
+    ).encode("utf-8")
+
+def read_xlsx_sheet_parts(zf):
+    """ربط اسم كل شيت بمسار ملف XML الخاص به داخل xlsx"""
+    workbook = ET.fromstring(zf.read("xl/workbook.xml"))
+    rels = ET.fromstring(zf.read("xl/_rels/workbook.xml.rels"))
+    targets = {rel.get("Id"): rel.get("Target") for rel in rels.iter(f"{{{XLSX_PKG_REL_NS}}}Relationship")}
+
+    parts = {}
+    for sheet in workbook.iter(f"{{{XLSX_MAIN_NS}}}sheet"):
+        target = targets[sheet.get(f"{{{XLSX_REL_NS}}}id")]
+        parts[sheet.get("name")] = target.lstrip("/") if target.startswith("/") else f"xl/{target}"
+    return parts
+
+def find_modified_sheets(sheets_dict):
+    """أسماء الشيتات التي تختلف عن لقطة الملف الحالي (حسب بصمة المحتوى)"""
+    manifest = load_snapshot_manifest(get_workbook_hash(), "object")
+    if manifest is None:
+        raise IncrementalWriteUnsupported("no snapshot")
+
+    base_hashes = {meta["name"]: meta["hash"] for meta in manifest["sheets"]}
+    if list(base_hashes) != list(sheets_dict):
+        raise IncrementalWriteUnsupported("sheets added, removed or reordered")
+
+    return [name for name, df in sheets_dict.items() if sheet_content_hash(df) != base_hashes[name]]
+
+def write_modified_sheets(path, sheets_dict):
+    """إعادة كتابة الشيتات المعدلة فقط داخل ملف xlsx ونسخ باقي محتوى الملف كما هو
+
+    تُرجع قائمة الشيتات التي أُعيدت كتابتها، أو ترفع IncrementalWriteUnsupported
+    عندما يلزم الحفظ الكامل (لا توجد لقطة، تغيرت قائمة الشيتات، خلايا تاريخ، calcChain).
+    """
+    modified = find_modified_sheets(sheets_dict)
+    if not modified:
+        return []
+
+    with zipfile.ZipFile(path) as src:
+        names = src.namelist()
+        if "xl/calcChain.xml" in names:
+            raise IncrementalWriteUnsupported("calcChain")
+
+        parts = read_xlsx_sheet_parts(src)
+        new_parts = {parts[name]: build_worksheet_xml(sheets_dict[name], src.read(parts[name])) for name in modified}
+
+        tmp_path = temp_path_beside(path)
+        try:
+            with zipfile.ZipFile(tmp_path, "w") as dst:
+                for info in src.infolist():
+                    data = new_parts.get(info.filename)
+                    dst.writestr(info, data if data is not None else src.read(info.filename))
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    os.replace(tmp_path, path)
+    return modified
+
+def write_full_workbook(path, sheets_dict):
+    """إعادة كتابة كل الشيتات بـ pd.ExcelWriter"""
+    with pd.ExcelWriter(path, engine="openpyxl") as writer:
+        for name, sh in sheets_dict.items():
+            try:
+                sh.to_excel(writer, sheet_name=name, index=False)
+            except Exception:
+                sh.astype(object).to_excel(writer, sheet_name=name, index=False)
+
+# -------------------------------
+# 🔀 دمج ثلاثي (أساس / محلي / GitHub) عند تعارض الرفع
+# -------------------------------
+def save_sync_base(content):
+    """حفظ نسخة الملف المشتركة مع GitHub كأساس للدمج (كتابة ذرية)"""
+    path = APP_CONFIG["SYNC_BASE_FILE"]
+    tmp_path = temp_path_beside(path)
+    with open(tmp_path, "wb") as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+def load_sync_base():
+    """محتوى نسخة الأساس (None إن لم تكن محفوظة)"""
+    if not os.path.exists(APP_CONFIG["SYNC_BASE_FILE"]):
+        return None
+    with open(APP_CONFIG["SYNC_BASE_FILE"], "rb") as f:
+        return f.read()
+
+def has_unsynced_local_changes():
+    """الملف المحلي يختلف عن آخر نسخة مشتركة مع المصدر (أو لا توجد نسخة أساس)، أو في السجل أحداث لم تُدمج"""
+    if get_event_journal().entries():
+        return True
+    if not os.path.exists(APP_CONFIG["LOCAL_FILE"]):
+        return False
+    base_content = load_sync_base()
+    return base_content is None or hashlib.sha256(base_content).hexdigest() != get_workbook_hash()
+
+def sync_base_sha():
+    """بصمة git blob لنسخة الأساس (None إن لم تكن محفوظة)"""
+    content = load_sync_base()
+    return git_blob_sha(content) if content is not None else None
+
+def read_workbook_bytes(content):
+    """قراءة كل الشيتات (dtype=object) من محتوى ملف في الذاكرة"""
+    sheets = pd.read_excel(io.BytesIO(content), sheet_name=None, dtype=object)
+    for name, df in sheets.items():
+        df.columns = df.columns.astype(str).str.strip()
+    return sheets
+
+def _row_keys(df):
+    """مفتاح نصي لكل صف للمقارنة (القيم الفارغة = "")"""
+    return [tuple("" if pd.isna(v) else str(v) for v in row) for row in df.itertuples(index=False, name=None)]
+
+def _row_changes(base_keys, side_keys):
+    """تغييرات جانب واحد مقارنة بالأساس: صفوف معدلة/محذوفة حسب رقم صف الأساس + صفوف مضافة بعد كل صف أساس"""
+    changed = {}   # رقم صف الأساس -> رقم الصف في الجانب، أو None إذا حُذف
+    inserted = {}  # رقم صف الأساس الذي تأتي بعده الإضافة (-1 = في البداية) -> أرقام الصفوف المضافة
+    matcher = difflib.SequenceMatcher(None, base_keys, side_keys, autojunk=False)
+    for op, b1, b2, s1, s2 in matcher.get_opcodes():
+        if op == "equal":
+            continue
+        if op == "replace" and b2 - b1 == s2 - s1:
+            changed.update({b1 + k: s1 + k for k in range(b2 - b1)})
+            continue
+        changed.update({b: None for b in range(b1, b2)})
+        if s2 > s1:
+            inserted.setdefault(b2 - 1, []).extend(range(s1, s2))
+    return changed, inserted
+
+def merge_sheet_rows(base, local, remote):
+    """دمج ثلاثي لصفوف شيت واحد: تغييرات كل طرف تُطبق، والمحلي يكسب عند تعارض نفس الخلية، والصفوف المضافة من الطرفين تُجمع"""
+    columns = list(local.columns) + [c for c in remote.columns if c not in set(local.columns)]
+    base, local, remote = (df.reindex(columns=columns).astype(object) for df in (base, local, remote))
+
+    base_keys, local_keys, remote_keys = _row_keys(base), _row_keys(local), _row_keys(remote)
+    local_changed, local_inserted = _row_changes(base_keys, local_keys)
+    remote_changed, remote_inserted = _row_changes(base_keys, remote_keys)
+
+    rows = []
+
+    def add_inserts(anchor):
+        local_new = local_inserted.get(anchor, [])
+        seen = {local_keys[i] for i in local_new}
+        rows.extend(local.iloc[i].tolist() for i in local_new)
+        # نفس الصف المضاف في الطرفين لا يتكرر
+        rows.extend(remote.iloc[i].tolist() for i in remote_inserted.get(anchor, []) if remote_keys[i] not in seen)
+
+    add_inserts(-1)
+    for b in range(len(base)):
+        if b not in local_changed and b not in remote_changed:
+            rows.append(base.iloc[b].tolist())
+        elif b not in local_changed:
+            if remote_changed[b] is not None:
+                rows.append(remote.iloc[remote_changed[b]].tolist())
+        elif b not in remote_changed or local_changed[b] is None or remote_changed[b] is None:
+            # تعديل/حذف محلي فقط، أو تعارض حذف مع تعديل: المحلي يكسب
+            if local_changed[b] is not None:
+                rows.append(local.iloc[local_changed[b]].tolist())
+        else:
+            # الصف معدل في الطرفين: دمج على مستوى الخلية (المحلي يكسب في نفس الخلية)
+            base_row, local_row = base_keys[b], local_keys[local_changed[b]]
+            local_values = local.iloc[local_changed[b]].tolist()
+            remote_values = remote.iloc[remote_changed[b]].tolist()
+            rows.append([
+                remote_values[j] if local_row[j] == base_row[j] else local_values[j]
+                for j in range(len(columns))
+            ])
+        add_inserts(b)
+
+    return pd.DataFrame(rows, columns=columns, dtype=object)
+
+def merge_workbook_sheets(base_sheets, local_sheets, remote_sheets):
+    """دمج ثلاثي على مستوى الشيتات ثم الصفوف"""
+    def unchanged(name, side):
+        return name in base_sheets and _row_keys(base_sheets[name]) == _row_keys(side[name]) \
+            and list(base_sheets[name].columns) == list(side[name].columns)
+
+    merged = {}
+    for name, local_df in local_sheets.items():
+        if name in remote_sheets:
+            base_df = base_sheets.get(name, local_df.iloc[0:0])
+            merged[name] = merge_sheet_rows(base_df, local_df, remote_sheets[name])
+        elif not unchanged(name, local_sheets):
+            # شيت جديد محلياً، أو حُذف على GitHub بعد تعديله محلياً (المحلي يكسب)
+            merged[name] = local_df
+    for name, remote_df in remote_sheets.items():
+        if name not in local_sheets and not unchanged(name, remote_sheets):
+            merged[name] = remote_df
+    return merged
+
+def merge_with_remote(remote_content, file_lock=None):
+    """دمج نسخة GitHub مع الملف المحلي الحالي على أساس آخر نسخة مشتركة، وكتابة الناتج محلياً
+
+    بدون نسخة أساس لا يمكن معرفة من عدّل ماذا، فيُرفع الملف المحلي كما هو (المحلي يكسب).
+    """
+    base_content = load_sync_base()
+    with file_lock or nullcontext():
+        with open(APP_CONFIG["LOCAL_FILE"], "rb") as f:
+            local_content = f.read()
+        if base_content is None:
+            return local_content
+
+        merged = merge_workbook_sheets(
+            read_workbook_bytes(base_content),
+            read_workbook_bytes(local_content),
+            read_workbook_bytes(remote_content),
+        )
+        # الشيتات التي تغيرت بالدمج فقط تُعاد كتابتها، فيبقى تنسيق الخلايا والدمج وقوائم التحقق في الملف المحلي
+        write_local_sheets(merged)
+        with open(APP_CONFIG["LOCAL_FILE"], "rb") as f:
+            merged_content = f.read()
+    return merged_content
+
+# -------------------------------
+# ⏳ طابور المزامنة مع GitHub في الخلفية (write-behind)
+# -------------------------------
+def push_workbook(backend, content, commit_message, file_lock=None):
+    """رفع محتوى الملف لمصدر المزامنة بطلب واحد (باستخدام آخر sha معروف)
+
+    إذا تغير الملف في المصدر منذ آخر نسخة مشتركة يُدمج معه دمجاً ثلاثياً ثم يُعاد الرفع.
+    تُرجع True إذا تم دمج تعديلات من المصدر.
+    """
+    state = get_remote_file_state()
+
+    merged = False
+    sha = state.get(backend.key)
+    if sha is None:
+        # لا نعرف آخر sha (بعد إعادة التشغيل): نقارن النسخة الحالية بنسخة الأساس
+        remote = backend.current()
+        base_content = load_sync_base()
+        if remote is not None and base_content is not None and remote.sha != git_blob_sha(base_content):
+            content = merge_with_remote(remote.content, file_lock)
+            merged = True
+        sha = remote.sha if remote is not None else None
+
+    for attempt in range(3):
+        try:
+            new_sha = backend.write(content, commit_message, sha)
+            break
+        except SyncConflict:
+            # sha قديم: تعديل من جلسة/مكان آخر، ندمج مع النسخة الحالية ونعيد المحاولة
+            if attempt == 2:
+                raise
+            state.pop(backend.key, None)
+            remote = backend.current()
+            if remote is not None:
+                content = merge_with_remote(remote.content, file_lock)
+                merged = True
+            sha = remote.sha if remote is not None else None
+
+    state[backend.key] = new_sha
+    save_sync_base(content)
+    return merged
+
+def load_sync_queue():
+    """قراءة التعديلات المنتظرة للرفع من ملف الطابور"""
+    if not os.path.exists(APP_CONFIG["SYNC_QUEUE_FILE"]):
+        return []
+    try:
+        with open(APP_CONFIG["SYNC_QUEUE_FILE"], "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception:
+        return []
+
+def save_sync_queue(queue):
+    """حفظ الطابور على القرص (كتابة ذرية) حتى لا تضيع التعديلات عند إعادة التشغيل"""
+    path = APP_CONFIG["SYNC_QUEUE_FILE"]
+    if not queue:
+        if os.path.exists(path):
+            os.remove(path)
+        return
+    tmp_path = temp_path_beside(path)
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(queue, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+def build_sync_commit_message(entries):
+    """رسالة commit واحدة لمجموعة تعديلات متتالية"""
+    if len(entries) == 1:
+        return entries[0]["message"]
+    lines = [f"{len(entries)} edits from Streamlit", ""]
+    lines += [f"- {entry['message']}" for entry in entries]
+    return "\n".join(lines)
+
+class SyncWorker:
+    """خيط واحد لكل العملية يرفع الملف المحلي إلى GitHub بعد هدوء التعديلات"""
+
+    def __init__(self, coalesce_seconds, retry_seconds):
+        self.coalesce_seconds = coalesce_seconds
+        self.retry_seconds = retry_seconds
+        self.backend = None
+        # قفل كتابة/قراءة الملف المحلي حتى لا يُرفع ملف نصف مكتوب
+        self.file_lock = threading.Lock()
+        self._cond = threading.Condition()
+        self._queue = load_sync_queue()
+        self._last_enqueue = time.time() if self._queue else 0.0
+        self._retry_at = 0.0
+        self.last_synced = None
+        self.last_merged = None
+        self.last_error = None
+        if not self._queue and load_sync_base() is None and os.path.exists(APP_CONFIG["LOCAL_FILE"]):
+            # لا توجد تعديلات منتظرة: الملف المحلي هو آخر نسخة مشتركة مع GitHub
+            with open(APP_CONFIG["LOCAL_FILE"], "rb") as f:
+                save_sync_base(f.read())
+        self._thread = threading.Thread(target=self._run, name="github-sync", daemon=True)
+        self._thread.start()
+
+    def enqueue(self, commit_message, username):
+        """إضافة تعديل للطابور (الملف المحلي محفوظ بالفعل) والعودة فوراً"""
+        with self._cond:
+            self._queue.append({
+                "message": commit_message,
+                "user": username,
+                "time": datetime.now().isoformat(timespec="seconds"),
+            })
+            save_sync_queue(self._queue)
+            self._last_enqueue = time.time()
+            self._cond.notify_all()
+
+    def pending_count(self):
+        with self._cond:
+            return len(self._queue)
+
+    def has_pending(self):
+        return self.pending_count() > 0
+
+    def sync_now(self):
+        """إلغاء نافذة التجميع ومهلة إعادة المحاولة ورفع المنتظر فوراً"""
+        with self._cond:
+            self._last_enqueue = 0.0
+            self._retry_at = 0.0
+            self._cond.notify_all()
+
+    def _next_push_delay(self):
+        # الانتظار حتى تنتهي نافذة التجميع ومهلة إعادة المحاولة
+        now = time.time()
+        return max(self._last_enqueue + self.coalesce_seconds - now, self._retry_at - now)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._queue or not self.backend or self._next_push_delay() > 0:
+                    if self._queue and self.backend:
+                        self._cond.wait(self._next_push_delay())
+                    else:
+                        self._cond.wait()
+                batch = list(self._queue)
+                backend = self.backend
+
+            try:
+                with self.file_lock:
+                    with open(APP_CONFIG["LOCAL_FILE"], "rb") as f:
+                        content = f.read()
+                merged = push_workbook(backend, content, build_sync_commit_message(batch), self.file_lock)
+            except Exception as e:
+                with self._cond:
+                    self.last_error = f"{datetime.now().strftime('%H:%M:%S')}: {e}"
+                    self._retry_at = time.time() + self.retry_seconds
+                continue
+
+            with self._cond:
+                # إزالة ما تم رفعه فقط (قد تكون أُضيفت تعديلات أثناء الرفع)
+                self._queue = self._queue[len(batch):]
+                save_sync_queue(self._queue)
+                self.last_synced = datetime.now()
+                self.last_error = None
+                if merged:
+                    self.last_merged = self.last_synced
+
+@st.cache_resource(show_spinner=False)
+def _get_sync_worker():
+    return SyncWorker(APP_CONFIG["SYNC_COALESCE_SECONDS"], APP_CONFIG["SYNC_RETRY_SECONDS"])
+
+def get_sync_worker():
+    """خيط المزامنة المشترك بين كل الجلسات (مع تحديث مصدر المزامنة من الإعدادات و secrets)"""
+    worker = _get_sync_worker()
+    backend = get_sync_backend()
+    if backend.can_push and worker.backend is not backend:
+        with worker._cond:
+            worker.backend = backend
+            worker._cond.notify_all()
+    return worker
+
+def show_sync_status():
+    """عرض حالة المزامنة في الشريط الجانبي"""
+    worker = get_sync_worker()
+    journal_count = len(get_event_journal().entries())
+    if journal_count:
+        st.info(f"📝 أحداث جديدة بانتظار الدمج في الملف: {journal_count}")
+    pending = worker.pending_count()
+    if pending:
+        st.info(f"⏳ بانتظار المزامنة مع {worker.backend.label if worker.backend else 'GitHub'}: {pending} تعديل")
+        if worker.last_error:
+            st.warning(f"⚠ آخر محاولة رفع فشلت: {worker.last_error}")
+        if worker.backend and st.button("⬆ رفع الآن", key="sync_now"):
+            worker.sync_now()
+    elif worker.last_synced:
+        st.caption(f"✅ آخر مزامنة مع {worker.backend.label}: {worker.last_synced.strftime('%H:%M:%S')}")
+        if worker.last_merged == worker.last_synced:
+            st.caption(f"🔀 تم دمج تعديلات من {worker.backend.label} مع التعديلات المحلية")
+
+# -------------------------------
+# 📡 متابعة التحديثات من GitHub في الخلفية
+# -------------------------------
+def install_remote_workbook(remote, file_lock, backend_key, pushed_sha):
+    """تجهيز لقطة النسخة الجديدة أولاً ثم استبدال الملف المحلي بها دفعة واحدة
+
+    الجلسات الجارية تكمل على اللقطة القديمة (تبقى محفوظة)، والتشغيل التالي يجد اللقطة الجديدة جاهزة.
+    تُرجع False إذا ظهرت تعديلات محلية (طابور، سجل، أو ملف يختلف عن نسخة الأساس) أو تم رفع نسخة جديدة
+    (آخر sha مرفوع لم يعد pushed_sha) أثناء التجهيز.
+    """
+    path = APP_CONFIG["LOCAL_FILE"]
+    tmp_path = temp_path_beside(path, ".incoming")
+    with open(tmp_path, "wb") as f:
+        f.write(remote.content)
+
+    state = get_remote_file_state()
+    try:
+        read_workbook("object", path=tmp_path)
+        read_workbook("typed", path=tmp_path)
+        with file_lock:
+            if _get_sync_worker().has_pending() or has_unsynced_local_changes() or state.get(backend_key) != pushed_sha:
+                return False
+            os.replace(tmp_path, path)
+            state[backend_key] = remote.sha
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    save_fetch_meta(backend_key, etag=remote.etag)
+    save_sync_base(remote.content)
+    return True
+
+class RemotePoller:
+    """خيط واحد لكل العملية يفحص GitHub كل فترة ويجهز النسخة الجديدة بعيداً عن طلبات المستخدمين"""
+
+    def __init__(self, interval_seconds):
+        self.interval_seconds = interval_seconds
+        self.backend = None
+        self.last_check = None
+        self.last_update = None
+        self.last_error = None
+        self._thread = threading.Thread(target=self._run, name="github-poller", daemon=True)
+        self._thread.start()
+
+    def poll_once(self):
+        """فحص واحد: True إذا تم تحميل نسخة جديدة واستبدال الملف المحلي بها"""
+        worker = _get_sync_worker()
+        backend = self.backend
+        # تعديلات محلية لم تُرفع بعد (في الطابور، أو محفوظة محلياً فقط بدون إمكانية رفع، أو في السجل):
+        # لا يُستبدل الملف، وطابور المزامنة هو من يتعامل مع النسخة الجديدة (بالدمج)
+        if backend is None or worker.has_pending() or has_unsynced_local_changes():
+            return False
+
+        # النسخة الأحدث تُعرف من sha المصدر نفسه وليس من بصمة المحتوى المحمّل
+        revision = backend.revision()
+        self.last_check = datetime.now()
+        pushed_sha = get_remote_file_state().get(backend.key)
+        if revision is None or revision in (pushed_sha, sync_base_sha()):
+            return False
+
+        remote = download_remote_workbook(backend)
+        # رد قديم من CDN (أو 304) لا يطابق sha المصدر: لا يُستبدل به الملف، ويُعاد الفحص في الدورة التالية
+        if remote is None or remote.sha != revision:
+            return False
+        if os.path.exists(APP_CONFIG["LOCAL_FILE"]) and hashlib.sha256(remote.content).hexdigest() == get_workbook_hash():
+            save_fetch_meta(backend.key, etag=remote.etag)
+            return False
+
+        if not install_remote_workbook(remote, worker.file_lock, backend.key, pushed_sha):
+            return False
+        self.last_update = datetime.now()
+        return True
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval_seconds)
+            try:
+                maybe_compact_event_journal()
+                self.poll_once()
+                self.last_error = None
+            except Exception as e:
+                self.last_error = f"{datetime.now().strftime('%H:%M:%S')}: {e}"
+
+@st.cache_resource(show_spinner=False)
+def _get_remote_poller():
+    return RemotePoller(APP_CONFIG["POLL_INTERVAL_SECONDS"])
+
+def start_background_refresh():
+    """تشغيل متابعة GitHub في الخلفية (إن كانت مفعلة)"""
+    if APP_CONFIG["POLL_INTERVAL_SECONDS"] > 0:
+        backend = get_sync_backend()
+        _get_remote_poller().backend = backend if backend.can_poll else None
+    maybe_compact_event_journal()
+
+def watch_remote_updates(can_edit):
+    """إعادة تحميل الصفحة عند وصول نسخة جديدة فقط (تغير RemotePoller.last_update)
+
+    لا تُفعل لمن يملك تبويب التعديل حتى لا تُقطع تعديلاته، ولا تُعاد الصفحة إذا لم تصل نسخة جديدة
+    (الفحص الدوري داخل fragment يعيد تشغيل نفسه فقط وليس الصفحة كلها).
+    """
+    if APP_CONFIG["AUTO_REFRESH_SECONDS"] <= 0 or APP_CONFIG["POLL_INTERVAL_SECONDS"] <= 0 or can_edit:
+        return
+    poller = _get_remote_poller()
+    st.session_state.setdefault("seen_remote_update", poller.last_update)
+
+    if hasattr(st, "fragment"):
+        def check_remote_update():
+            if poller.last_update != st.session_state["seen_remote_update"]:
+                st.session_state["seen_remote_update"] = poller.last_update
+                st.rerun()
+        st.fragment(run_every=APP_CONFIG["AUTO_REFRESH_SECONDS"])(check_remote_update)()
+    elif AUTOREFRESH_AVAILABLE:
+        # إصدارات Streamlit القديمة (بدون fragment): إعادة تحميل دورية للصفحة كلها
+        st_autorefresh(interval=APP_CONFIG["AUTO_REFRESH_SECONDS"] * 1000, key="auto_refresh")
+
+def write_local_sheets(sheets_dict):
+    """حفظ الشيتات في الملف المحلي (الشيتات المعدلة فقط إن أمكن، وإلا كل الملف)"""
+    try:
+        write_modified_sheets(APP_CONFIG["LOCAL_FILE"], sheets_dict)
+    except (IncrementalWriteUnsupported, KeyError, zipfile.BadZipFile, ET.ParseError):
+        write_full_workbook(APP_CONFIG["LOCAL_FILE"], sheets_dict)
+
+# -------------------------------
+# 🔁 حفظ محلي + إضافة للطابور للرفع على GitHub في الخلفية
+# -------------------------------
+def save_local_excel_and_push(sheets_dict, commit_message="Update from Streamlit"):
+    """حفظ محلي فوري ثم إضافة التعديل لطابور الرفع إلى GitHub (بدون انتظار الرفع)"""
+    worker = get_sync_worker()
+    journal = get_event_journal()
+
+    # احفظ محلياً مع أحداث السجل (المعروضة في واجهة التحرير + ما أُضيف بعد تحميلها)
+    backend = get_sync_backend()
+    try:
+        with worker.file_lock:
+            entries = journal.entries()
+            folded_ids = set(st.session_state.get("journal_folded_ids", []))
+            sheets_dict = fold_journal_entries(sheets_dict, [entry for entry in entries if entry["id"] not in folded_ids])
+            write_local_sheets(sheets_dict)
+            journal.remove(entry["id"] for entry in entries)
+            # الإضافة للطابور قبل ترك القفل: وإلا قد تستبدل متابعة GitHub الملف قبل أن يظهر التعديل كمنتظر
+            if backend.can_push:
+                worker.enqueue(commit_message, st.session_state.get("username", "unknown"))
+    except Exception as e:
+        st.error(f"⚠ خطأ أثناء الحفظ المحلي: {e}")
+        return None
+
+    # لا حاجة لمسح الكاش: بصمة الملف تغيرت فتُقرأ النسخة الجديدة تلقائياً
+
+    if not backend.can_push:
+        st.warning(backend.push_unavailable_reason())
+        return load_sheets_for_edit()
+
+    st.info(f"⏳ تم الحفظ محلياً، وسيتم الرفع إلى {backend.label} في الخلفية.")
+    return load_sheets_for_edit()
+
+def auto_save_to_github(sheets_dict, operation_description):
+    """دالة الحفظ التلقائي المحسنة"""
+    username = st.session_state.get("username", "unknown")
+    commit_message = f"{operation_description} by {username} at {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
+    
+    result = save_local_excel_and_push(sheets_dict, commit_message)
+    if result is not None:
+        st.success("✅ تم حفظ التغييرات")
+        return result
+    else:
+        st.error("❌ فشل الحفظ التلقائي")
+        return sheets_dict
+
+# -------------------------------
+# 🧰 دوال مساعدة للمعالجة والنصوص
+# -------------------------------
+def shared_lru_cache(maxsize):
+    """مثل functools.lru_cache لكن الذاكرة تبقى بين إعادات تشغيل السكربت (Streamlit يعيد تعريف دوال الملف في كل تشغيل)
+
+    المفتاح يشمل بصمة كود الدالة، فتعديل الدالة ينشئ ذاكرة جديدة بدلاً من استخدام نتائج الكود القديم.
+    """
+    def decorator(func):
+        code_hash = hashlib.sha256(marshal.dumps(func.__code__)).hexdigest()
+        return _shared_lru_cache(func.__qualname__, code_hash, maxsize, func)
+    return decorator
+
+@st.cache_resource(show_spinner=False)
+def _shared_lru_cache(name, code_hash, maxsize, _func):
+    return lru_cache(maxsize=maxsize)(_func)
+
+NAME_INVALID_CHARS_RE = re.compile(r"[^0-9a-zA-Z\u0600-\u06FF\+\s_/.-]")
+NAME_SPACES_RE = re.compile(r"\s+")
+SERVICE_SEPARATORS_RE = re.compile(r"\+|,|\n|;")
+
+def normalize_name(s):
+    if s is None: return ""
+    return _normalize_text(str(s))
+
+@shared_lru_cache(maxsize=APP_CONFIG["TEXT_CACHE_SIZE"])
+def _normalize_text(s):
+    s = s.replace("\n", "+")
+    s = NAME_INVALID_CHARS_RE.sub(" ", s)
+    s = NAME_SPACES_RE.sub(" ", s).strip().lower()
+    return s
+
+def split_needed_services(needed_service_str):
+    if not isinstance(needed_service_str, str) or needed_service_str.strip() == "":
+        return []
+    return list(_split_services_text(needed_service_str))
+
+@shared_lru_cache(maxsize=APP_CONFIG["TEXT_CACHE_SIZE"])
+def _split_services_text(text):
+    parts = SERVICE_SEPARATORS_RE.split(text)
+    return tuple(p.strip() for p in parts if p.strip() != "")
+
+ARABIC_LETTER_VARIANTS = str.maketrans({"أ": "ا", "إ": "ا", "آ": "ا", "ة": "ه", "ى": "ي"})
+SERVICE_KEY_SEPARATORS_RE = re.compile(r"[\s_./-]+")
+
+def service_key(name):
+    """مفتاح اسم الخدمة بدون فرق في المسافات والشرطات وحالة الأحرف وأشكال الألف والتاء المربوطة"""
+    return SERVICE_KEY_SEPARATORS_RE.sub("", normalize_name(name).translate(ARABIC_LETTER_VARIANTS))
+
+class ServiceRegistry:
+    """قاموس موحد للخدمات: كل كتابة لاسم الخدمة (عمود في شيت ماكينة أو جزء من خانة Service) → رقم خدمة
+
+    أسماء ServicePlan تُسجل أولاً فيكون اسم العرض لكل خدمة هو كتابتها في ServicePlan (أو الاسم الموحد في
+    SERVICE_ALIASES)، ثم عناوين كل شيتات الماكينات مرتبة أبجدياً (أصغر كتابة هي اسم العرض)، فلا يتوقف
+    اسم العرض على ترتيب فحص الماكينات.
+    """
+
+    def __init__(self, names=(), aliases=None):
+        self._lock = threading.Lock()
+        self._by_key = {}
+        self._by_name = {}
+        self.labels = []
+        for canonical, alias_names in (aliases or {}).items():
+            service_id = self.id(canonical)
+            for alias in alias_names:
+                self._by_key.setdefault(service_key(alias), service_id)
+        for name in names:
+            self.id(name)
+
+    def id(self, name):
+        """رقم الخدمة (يُضاف رقم جديد لأي اسم غير معروف)"""
+        service_id = self._by_name.get(name)
+        if service_id is None:
+            key = service_key(name)
+            with self._lock:
+                service_id = self._by_key.get(key)
+                if service_id is None:
+                    service_id = len(self.labels)
+                    self.labels.append(name)
+                    self._by_key[key] = service_id
+                self._by_name[name] = service_id
+        return service_id
+
+    def label(self, service_id):
+        return self.labels[service_id]
+
+    def mask(self, names):
+        """مجموعة خدمات كـ bitmask (البت رقم id لكل خدمة)"""
+        bits = 0
+        for name in names:
+            bits |= 1 << self.id(name)
+        return bits
+
+def text_cache_stats():
+    """عدادات ذاكرة التطبيع وتقسيم الخدمات (hits / misses / الحجم)"""
+    return {
+        "normalize_name": _normalize_text.cache_info(),
+        "split_needed_services": _split_services_text.cache_info(),
+    }
+
+def highlight_cell(val, col_name):
+    color_map = {
+        "Service Needed": "background-color: #fff3cd; color:#856404; font-weight:bold;",
+        "Service Done": "background-color: #d4edda; color:#155724; font-weight:bold;",
+        "Service Didn't Done": "background-color: #f8d7da; color:#721c24; font-weight:bold;",
+        "Date": "background-color: #e7f1ff; color:#004085; font-weight:bold;",
+        "Tones": "background-color: #e8f8f5; color:#0d5c4a; font-weight:bold;",
+        "Event": "background-color: #e2f0d9; color:#2e6f32; font-weight:bold;",
+        "Correction": "background-color: #fdebd0; color:#7d6608; font-weight:bold;",
+        "Servised by": "background-color: #f0f0f0; color:#333; font-weight:bold;",
+        "Card Number": "background-color: #ebdef0; color:#4a235a; font-weight:bold;"
+    }
+    return color_map.get(col_name, "")
+
+def style_table(row):
+    return [highlight_cell(row[col], col) for col in row.index]
+
+def get_user_permissions(user_role, user_permissions):
+    """الحصول على صلاحيات المستخدم بناءً على الدور والصلاحيات"""
+    # إذا كان الدور admin، يعطى جميع الصلاحيات
+    if user_role == "admin":
+        return {
+            "can_view": True,
+            "can_edit": True,
+            "can_manage_users": True,
+            "can_see_tech_support": True
+        }
+    
+    # إذا كان الدور editor
+    elif user_role == "editor":
+        return {
+            "can_view": True,
+            "can_edit": True,
+            "can_manage_users": False,
+            "can_see_tech_support": False
+        }
+    
+    # إذا كان الدور viewer أو أي دور آخر
+    else:
+        # التحقق من الصلاحيات الفردية
+        return {
+            "can_view": "view" in user_permissions or "edit" in user_permissions or "all" in user_permissions,
+            "can_edit": "edit" in user_permissions or "all" in user_permissions,
+            "can_manage_users": "manage_users" in user_permissions or "all" in user_permissions,
+            "can_see_tech_support": "tech_support" in user_permissions or "all" in user_permissions
+        }
+
+# قائمة بالأعمدة المحتملة لفني الخدمة
+SERVICED_BY_COLUMNS = [
+    "Servised by", "SERVISED BY", "servised by", "Servised By",
+    "Serviced by", "Service by", "Serviced By", "Service By",
+    "خدم بواسطة", "تم الخدمة بواسطة", "فني الخدمة"
+]
+
+def get_servised_by_value(row, roles=None):
+    """استخراج قيمة فني الخدمة من الصف"""
+    roles = roles or column_roles(row.index)
+    # الأعمدة المعروفة أولاً ثم الأعمدة التي قد تحتوي على فني الخدمة
+    for col in roles.technician:
+        value = str(row[col]).strip()
+        if value and value.lower() not in ["nan", "none", ""]:
+            return value
+    
+    return "-"
+
+# أعمدة البيانات الوصفية في شيت الماكينة (كل الأعمدة الأخرى أعمدة خدمات)
+SERVICE_METADATA_COLUMNS = {
+    "card", "Tones", "Min_Tones", "Max_Tones", "Date", 
+    "Other", "Servised by", "Event", "Correction",
+    "Card", "TONES", "MIN_TONES", "MAX_TONES", "DATE",
+    "OTHER", "EVENT", "CORRECTION", "SERVISED BY",
+    "servised by", "Servised By", 
+    "Serviced by", "Service by", "Serviced By", "Service By",
+    "خدم بواسطة", "تم الخدمة بواسطة", "فني الخدمة"
+}
+SERVICE_METADATA_NORMALIZED = {normalize_name(c) for c in SERVICE_METADATA_COLUMNS}
+
+# القيم التي لا تعني أن الخدمة تمت
+SERVICE_EMPTY_VALUES = {"nan", "none", "", "null", "0"}
+SERVICE_NOT_DONE_VALUES = {"no", "false", "not done", "لم تتم", "x", "-"}
+
+# أدوار أعمدة الشيت (كل قائمة بترتيب أعمدة الشيت)
+ColumnRoles = namedtuple("ColumnRoles", ["service", "tonnage", "date", "event", "correction", "technician", "metadata"])
+
+def column_roles(columns):
+    """تصنيف أعمدة الشيت حسب الدور (يُحسب مرة واحدة لكل مجموعة عناوين)"""
+    return _resolve_column_roles(tuple(columns))
+
+@shared_lru_cache(maxsize=512)
+def _resolve_column_roles(columns):
+    normalized = [normalize_name(col) for col in columns]
+    tech_keywords = ["servisedby", "servicedby", "serviceby", "خدمبواسطة", "فني"]
+
+    service = []
+    metadata = []
+    for col, col_normalized in zip(columns, normalized):
+        if col in SERVICE_METADATA_COLUMNS or col_normalized in SERVICE_METADATA_NORMALIZED:
+            metadata.append(col)
+        else:
+            service.append(col)
+
+    return ColumnRoles(
+        service=tuple(service),
+        tonnage=tuple(col for col, n in zip(columns, normalized) if n in ("tones", "min_tones", "max_tones")),
+        date=tuple(col for col, n in zip(columns, normalized) if n == "date"),
+        event=tuple(col for col, n in zip(columns, normalized) if "event" in n or "الحدث" in n),
+        correction=tuple(col for col, n in zip(columns, normalized) if "correction" in n or "تصحيح" in n),
+        # الأعمدة المعروفة أولاً (بترتيب SERVICED_BY_COLUMNS) ثم أي عمود يحتوي اسمه على كلمة دالة
+        technician=tuple(col for col in SERVICED_BY_COLUMNS if col in columns) + tuple(
+            col for col, n in zip(columns, normalized) if any(k in n for k in tech_keywords)
+        ),
+        metadata=tuple(metadata),
+    )
+
+def is_service_done_value(text):
+    """هل نص الخلية يعني أن الخدمة تمت؟"""
+    value = text.strip()
+    return bool(value) and value.lower() not in SERVICE_EMPTY_VALUES and value.lower() not in SERVICE_NOT_DONE_VALUES
+
+def service_done_matrix(df, service_columns):
+    """مصفوفة (صفوف × أعمدة خدمات) منطقية: هل تمت الخدمة
+
+    نص كل الخلايا يُحسب دفعة واحدة، ثم تُرقَّم القيم المختلفة (np.unique) ويُفحص كل نص مختلف مرة واحدة
+    فقط، والنتيجة جدول بحث يُطبق على أرقام كل الخلايا.
+    """
+    if len(df) == 0 or not service_columns:
+        return np.zeros((len(df), len(service_columns)), dtype=bool)
+    values = df[list(service_columns)].to_numpy(dtype=object).astype(str)
+    uniques, codes = np.unique(values, return_inverse=True)
+    lookup = np.array([is_service_done_value(value) for value in uniques], dtype=bool)
+    return lookup[codes].reshape(values.shape)
+
+def servised_by_values(df, roles=None):
+    """نفس get_servised_by_value لكل صفوف الـ DataFrame مرة واحدة"""
+    roles = roles or column_roles(df.columns)
+    result = np.full(len(df), "-", dtype=object)
+    # من آخر عمود مرشح لأوله حتى يكسب أول عمود فيه قيمة (مثل ترتيب البحث في get_servised_by_value)
+    for col in reversed(roles.technician):
+        values = np.array([str(v).strip() for v in df[col].tolist()], dtype=object)
+        valid = np.array([v != "" and v.lower() not in ("nan", "none") for v in values], dtype=bool)
+        result = np.where(valid, values, result)
+    return result
+
+def parse_needed_services(service_text, registry):
+    """(أجزاء خانة Service في ServicePlan، أرقام الخدمات المقابلة في القاموس الموحد)"""
+    needed_parts = split_needed_services(service_text)
+    return needed_parts, [registry.id(p) for p in needed_parts]
+
+def slice_row_overlaps(selected_slices, services_df):
+    """مصفوفة التقاطع (شرائح × صفوف): الصف يتقاطع مع الشريحة إذا Min_Tones <= max الشريحة و Max_Tones >= min الشريحة"""
+    slice_mins = selected_slices["Min_Tones"].to_numpy()
+    slice_maxs = selected_slices["Max_Tones"].to_numpy()
+    n_rows = len(services_df)
+    row_mins = services_df["Min_Tones"].fillna(0).to_numpy() if "Min_Tones" in services_df.columns else np.zeros(n_rows)
+    row_maxs = services_df["Max_Tones"].fillna(0).to_numpy() if "Max_Tones" in services_df.columns else np.zeros(n_rows)
+    return (row_mins[np.newaxis, :] <= slice_maxs[:, np.newaxis]) & (row_maxs[np.newaxis, :] >= slice_mins[:, np.newaxis])
+
+def compute_service_status(card_num, services_df, selected_slices, needed_services=None, registry=None):
+    """ربط شرائح ServicePlan بصفوف خدمات الماكينة (تقاطع المدى) وحساب المطلوب/المنفذ/المتبقي
+
+    الربط يتم مرة واحدة بمصفوفة تقاطع (شرائح × صفوف) بدلاً من قناع لكل شريحة، وبيانات كل صف
+    (الخدمات المنفذة، الفني، التاريخ، الأطنان) تُحسب مرة واحدة فقط مهما تكرر في أكثر من شريحة.
+    الخدمات المنفذة والمطلوبة تُطابق بأرقامها في ServiceRegistry (bitmask لكل صف)، والإحصائيات مجمعة باسم
+    العرض الموحد لكل خدمة. needed_services: (الخدمات المطلوبة، أرقامها) لكل شريحة إن كانت محسوبة مسبقاً.
+    تُرجع (result_df, service_stats) بنفس ترتيب وقيم الفحص صفاً صفاً.
+    """
+    all_results = []
+    service_stats = {
+        "service_counts": {},  # تعداد كل خدمة مطلوبة
+        "service_done_counts": {},  # تعداد الخدمات المنفذة
+        "total_needed_services": 0,
+        "total_done_services": 0,
+        "by_slice": {}  # إحصائيات حسب الشريحة
+    }
+
+    slice_mins = selected_slices["Min_Tones"].to_numpy()
+    slice_maxs = selected_slices["Max_Tones"].to_numpy()
+    if registry is None:
+        registry = ServiceRegistry(aliases=APP_CONFIG["SERVICE_ALIASES"])
+    if needed_services is None:
+        slice_services = selected_slices["Service"].tolist() if "Service" in selected_slices.columns else [""] * len(selected_slices)
+        needed_services = [parse_needed_services(service, registry) for service in slice_services]
+    overlaps = slice_row_overlaps(selected_slices, services_df)
+
+    # بيانات الصفوف المتقاطعة مع أي شريحة (مرة واحدة لكل صف)
+    matched = np.flatnonzero(overlaps.any(axis=0))
+    matched_df = services_df.iloc[matched]
+    roles = column_roles(services_df.columns)
+    service_columns = roles.service
+    done_matrix = service_done_matrix(matched_df, service_columns)
+    column_ids = [registry.id(col) for col in service_columns]
+    dates = matched_df["Date"].tolist() if "Date" in matched_df.columns else [None] * len(matched)
+    tones = matched_df["Tones"].tolist() if "Tones" in matched_df.columns else [None] * len(matched)
+    techs = servised_by_values(matched_df, roles)
+
+    row_info = {}
+    for k, i in enumerate(matched):
+        done_positions = np.flatnonzero(done_matrix[k])
+        done_mask = 0
+        for j in done_positions:
+            done_mask |= 1 << column_ids[j]
+        row_info[i] = {
+            "done_ids": [column_ids[j] for j in done_positions],
+            "done_services": sorted(service_columns[j] for j in done_positions),
+            "done_mask": done_mask,
+            "date": str(dates[k]).strip() if pd.notna(dates[k]) else "-",
+            "tones": str(tones[k]).strip() if pd.notna(tones[k]) else "-",
+            "tech": techs[k],
+        }
+
+    for s, (slice_min, slice_max) in enumerate(zip(slice_mins, slice_maxs)):
+        slice_key = f"{slice_min}-{slice_max}"
+
+        needed_parts, needed_ids = needed_services[s]
+        needed_parts = list(needed_parts)
+        
+        # تحديث إحصائيات الخدمات المطلوبة
+        service_stats["by_slice"][slice_key] = {
+            "needed": needed_parts,
+            "done": [],
+            "not_done": [],
+            "total_needed": len(needed_parts),
+            "total_done": 0
+        }
+        
+        for service_id in needed_ids:
+            service = registry.label(service_id)
+            service_stats["service_counts"][service] = service_stats["service_counts"].get(service, 0) + 1
+        service_stats["total_needed_services"] += len(needed_parts)
+
+        matching_rows = np.flatnonzero(overlaps[s])
+        if len(matching_rows) == 0:
+            # إذا لم توجد سجلات سيرفيس
+            all_results.append({
+                "Card Number": card_num,
+                "Min_Tons": slice_min,
+                "Max_Tons": slice_max,
+                "Service Needed": " + ".join(needed_parts) if needed_parts else "-",
+                "Service Done": "-",
+                "Service Didn't Done": ", ".join(needed_parts) if needed_parts else "-",
+                "Tones": "-",
+                "Servised by": "-",
+                "Date": "-"
+            })
+            
+            # تحديث إحصائيات الشريحة (لا يوجد خدمات منفذة)
+            service_stats["by_slice"][slice_key]["not_done"] = needed_parts.copy()
+            continue
+
+        for i in matching_rows:
+            info = row_info[i]
+            done_services = info["done_services"]
+
+            # تحديث إحصائيات الخدمات المنفذة
+            for service_id in info["done_ids"]:
+                service = registry.label(service_id)
+                service_stats["service_done_counts"][service] = service_stats["service_done_counts"].get(service, 0) + 1
+            service_stats["total_done_services"] += len(done_services)
+
+            # تحديث إحصائيات الشريحة
+            service_stats["by_slice"][slice_key]["done"].extend(done_services)
+            service_stats["by_slice"][slice_key]["total_done"] += len(done_services)
+
+            # مقارنة الخدمات المنجزة مع المطلوبة
+            not_done = [
+                needed_part for needed_part, service_id in zip(needed_parts, needed_ids)
+                if not info["done_mask"] >> service_id & 1
+            ]
+            service_stats["by_slice"][slice_key]["not_done"].extend(not_done)
+
+            all_results.append({
+                "Card Number": card_num,
+                "Min_Tons": slice_min,
+                "Max_Tons": slice_max,
+                "Service Needed": " + ".join(needed_parts) if needed_parts else "-",
+                "Service Done": ", ".join(done_services) if done_services else "-",
+                "Service Didn't Done": ", ".join(not_done) if not_done else "-",
+                "Tones": info["tones"],
+                "Servised by": info["tech"],
+                "Date": info["date"]
+            })
+
+    result_df = pd.DataFrame(all_results).dropna(how="all").reset_index(drop=True)
+    return result_df, service_stats
+
+# -------------------------------
+# 📐 فهرس شرائح الأطنان في ServicePlan
+# -------------------------------
+class ServicePlanIndex:
+    """فهرس مرتب لحدود شرائح ServicePlan (بحث ثنائي بدلاً من فلترة الشيت كاملاً لكل استعلام)
+
+    الشرائح مرتبة حسب (Min_Tones, Max_Tones). إذا كانت Max_Tones غير متناقصة بهذا الترتيب (الحالة
+    المعتادة لشرائح لا تتداخل) فكل استعلام يكون مدى متصلاً يُحدد ببحثين ثنائيين، وإلا يُفلتر المدى
+    المرشح فقط. كل الاستعلامات تُرجع مواقع الصفوف بترتيب الشيت الأصلي.
+    """
+
+    def __init__(self, plan_df, service_columns=()):
+        self.plan_df = plan_df
+        mins = pd.to_numeric(plan_df["Min_Tones"], errors="coerce").to_numpy(dtype=float) if "Min_Tones" in plan_df.columns else np.full(len(plan_df), np.nan)
+        maxs = pd.to_numeric(plan_df["Max_Tones"], errors="coerce").to_numpy(dtype=float) if "Max_Tones" in plan_df.columns else np.full(len(plan_df), np.nan)
+
+        # الشرائح بدون حدود رقمية لا تطابق أي استعلام حدود (مثل مقارنة NaN في الفلترة)
+        valid_min = np.flatnonzero(~np.isnan(mins))
+        valid_max = np.flatnonzero(~np.isnan(maxs))
+        self._by_min = valid_min[np.lexsort((maxs[valid_min], mins[valid_min]))]
+        self._by_max = valid_max[np.argsort(maxs[valid_max], kind="stable")]
+        self._mins_sorted = mins[self._by_min]
+        self._maxs_sorted = maxs[self._by_max]
+        self._maxs_by_min = maxs[self._by_min]
+        self._monotone = len(valid_min) == len(valid_max) == len(plan_df) and bool(np.all(np.diff(self._maxs_by_min) >= 0))
+
+        # الخدمات المطلوبة لكل شريحة (مقسمة ومرقمة مرة واحدة لكل نسخة من ServicePlan)
+        services = plan_df["Service"].tolist() if "Service" in plan_df.columns else [""] * len(plan_df)
+        self.registry = ServiceRegistry(aliases=APP_CONFIG["SERVICE_ALIASES"])
+        self.needed_services = [parse_needed_services(service, self.registry) for service in services]
+        for name in sorted(service_columns):
+            self.registry.id(name)
+
+    def _positions(self, order, lo, hi, keep=None):
+        positions = order[lo:hi]
+        if keep is not None:
+            positions = positions[keep[lo:hi]]
+        return np.sort(positions)
+
+    def containing(self, tons):
+        """مواقع الشرائح التي تحتوي الطن (Min_Tones <= T <= Max_Tones)"""
+        hi = np.searchsorted(self._mins_sorted, tons, side="right")
+        if self._monotone:
+            lo = np.searchsorted(self._maxs_by_min, tons, side="left")
+            return self._positions(self._by_min, lo, hi)
+        return self._positions(self._by_min, 0, hi, self._maxs_by_min >= tons)
+
+    def below(self, tons):
+        """مواقع الشرائح التي تنتهي عند الطن أو قبله (Max_Tones <= T)"""
+        return self._positions(self._by_max, 0, np.searchsorted(self._maxs_sorted, tons, side="right"))
+
+    def above(self, tons):
+        """مواقع الشرائح التي تبدأ عند الطن أو بعده (Min_Tones >= T)"""
+        return self._positions(self._by_min, np.searchsorted(self._mins_sorted, tons, side="left"), None)
+
+    def within(self, low, high):
+        """مواقع الشرائح الواقعة بالكامل داخل [low, high]"""
+        lo = np.searchsorted(self._mins_sorted, low, side="left")
+        if self._monotone:
+            hi = np.searchsorted(self._maxs_by_min, high, side="right")
+            return self._positions(self._by_min, lo, max(lo, hi))
+        return self._positions(self._by_min, lo, None, self._maxs_by_min <= high)
+
+    def containing_many(self, tons_values):
+        """containing() لمجموعة أطنان مرة واحدة (قائمة مواقع لكل طن)"""
+        tons_values = np.asarray(tons_values, dtype=float)
+        his = np.searchsorted(self._mins_sorted, tons_values, side="right")
+        if self._monotone:
+            los = np.searchsorted(self._maxs_by_min, tons_values, side="left")
+            return [self._positions(self._by_min, lo, hi) for lo, hi in zip(los, his)]
+        return [self._positions(self._by_min, 0, hi, self._maxs_by_min >= t) for t, hi in zip(tons_values, his)]
+
+    def below_many(self, tons_values):
+        """below() لمجموعة أطنان مرة واحدة"""
+        his = np.searchsorted(self._maxs_sorted, np.asarray(tons_values, dtype=float), side="right")
+        return [self._positions(self._by_max, 0, hi) for hi in his]
+
+    def above_many(self, tons_values):
+        """above() لمجموعة أطنان مرة واحدة"""
+        los = np.searchsorted(self._mins_sorted, np.asarray(tons_values, dtype=float), side="left")
+        return [self._positions(self._by_min, lo, None) for lo in los]
+
+    def positions(self, view_option, current_tons, min_range, max_range):
+        """مواقع شرائح ServicePlan حسب نطاق العرض المختار في فحص السيرفيس"""
+        if view_option == "الشريحة الحالية فقط":
+            return self.containing(current_tons)
+        elif view_option == "كل الشرائح الأقل":
+            return self.below(current_tons)
+        elif view_option == "كل الشرائح الأعلى":
+            return self.above(current_tons)
+        elif view_option == "نطاق مخصص":
+            return self.within(min_range, max_range)
+        return np.arange(len(self.plan_df))
+
+    def select(self, view_option, current_tons, min_range, max_range):
+        """شرائح ServicePlan حسب نطاق العرض المختار في فحص السيرفيس"""
+        return self.plan_df.iloc[self.positions(view_option, current_tons, min_range, max_range)]
+
+CARD_SHEET_RE = re.compile(r"Card\d+(_Services)?")
+
+def _collect_card_service_columns(all_sheets, sheet_columns):
+    names = set()
+    for sheet_name in all_sheets:
+        if CARD_SHEET_RE.fullmatch(sheet_name):
+            names.update(column_roles(sheet_columns(sheet_name)).service)
+    return tuple(sorted(names))
+
+def card_service_columns(all_sheets):
+    """أعمدة الخدمات في كل شيتات الماكينات (مرة واحدة لكل نسخة من الملف، من العناوين فقط بدون تحميل الشيتات)"""
+    if hasattr(all_sheets, "sheet_columns"):
+        return _card_service_columns_cached(all_sheets, all_sheets.version)
+    return _collect_card_service_columns(all_sheets, lambda name: all_sheets[name].columns)
+
+@st.cache_resource(show_spinner=False, max_entries=4)
+def _card_service_columns_cached(_all_sheets, version):
+    return _collect_card_service_columns(_all_sheets, _all_sheets.sheet_columns)
+
+def get_service_plan_index(all_sheets):
+    """فهرس ServicePlan للنسخة الحالية من الملف (مع قاموس خدمات مبني من ServicePlan وعناوين شيتات الماكينات)"""
+    service_columns = card_service_columns(all_sheets)
+    if hasattr(all_sheets, "sheet_hash"):
+        return _service_plan_index_cached(all_sheets, all_sheets.sheet_hash("ServicePlan"), service_columns)
+    return ServicePlanIndex(all_sheets["ServicePlan"], service_columns)
+
+@st.cache_resource(show_spinner=False, max_entries=4)
+def _service_plan_index_cached(_all_sheets, sheet_hash, service_columns):
+    return ServicePlanIndex(_all_sheets["ServicePlan"], service_columns)
+
+def find_card_services_sheet(all_sheets, card_num):
+    """شيت خدمات الماكينة: Card{n}_Services إن وجد وإلا الشيت القديم Card{n} (None إذا لم يوجد أي منهما)"""
+    for sheet_name in (f"Card{card_num}_Services", f"Card{card_num}"):
+        if sheet_name in all_sheets:
+            return sheet_name
+    return None
+
+def load_card_services(all_sheets, sheet_name, store=None, selected_slices=None):
+    """صفوف خدمات الماكينة (من الشيت القديم فقط الصفوف التي لها Min_Tones و Max_Tones)"""
+    require_range = not sheet_name.endswith("_Services")
+    if store is not None:
+        # صفوف الخدمات المتقاطعة مع مدى كل الشرائح المختارة (بفهرس الأطنان)، والربط بكل شريحة يتم في compute_service_status
+        return store.service_rows(
+            sheet_name,
+            pd.to_numeric(selected_slices["Min_Tones"], errors="coerce").min(),
+            pd.to_numeric(selected_slices["Max_Tones"], errors="coerce").max(),
+            require_range=require_range,
+        )
+
+    card_df = all_sheets[sheet_name]
+    if not require_range:
+        return card_df.copy()
+    return card_df[
+        (card_df.get("Min_Tones", pd.NA).notna()) & 
+        (card_df.get("Max_Tones", pd.NA).notna()) &
+        (card_df.get("Min_Tones", "") != "") & 
+        (card_df.get("Max_Tones", "") != "")
+    ].copy()
+
+# -------------------------------
+# 🧾 مصفوفة الامتثال (ماكينة × شريحة × خدمة)
+# -------------------------------
+def combine_service_status(pieces):
+    """تجميع نتائج شرائح منفصلة في (result_df, service_stats) بنفس شكل compute_service_status"""
+    service_stats = {
+        "service_counts": {},
+        "service_done_counts": {},
+        "total_needed_services": 0,
+        "total_done_services": 0,
+        "by_slice": {}
+    }
+    for _, stats in pieces:
+        for key in ("service_counts", "service_done_counts"):
+            for service, count in stats[key].items():
+                service_stats[key][service] = service_stats[key].get(service, 0) + count
+        service_stats["total_needed_services"] += stats["total_needed_services"]
+        service_stats["total_done_services"] += stats["total_done_services"]
+        for slice_key, slice_stats in stats["by_slice"].items():
+            # نسخة من القوائم حتى لا تتغير النتائج المخزنة في المصفوفة
+            service_stats["by_slice"][slice_key] = {
+                key: list(value) if isinstance(value, list) else value for key, value in slice_stats.items()
+            }
+
+    frames = [result_df for result_df, _ in pieces if not result_df.empty]
+    result_df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+    return result_df, service_stats
+
+class ComplianceMatrix:
+    """نتيجة فحص السيرفيس الجاهزة لكل ماكينة ولكل شريحة في ServicePlan (الخدمات المنفذة/المتبقية، التاريخ، الفني)
+
+    تُبنى الماكينة عند أول طلب لها وتبقى ما دامت بصمة شيتها لم تتغير. عند تعديل الشيت تُعاد فقط الشرائح
+    التي تغيرت صفوفها المتقاطعة (بصمة كل صف)، وأي تغيير في ServicePlan (أو في قاموس الخدمات) يعيد بناء
+    المصفوفة كاملة.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.plan_index = None
+        self._machines = {}
+        self.recomputed_slices = 0
+
+    def _plan(self, all_sheets):
+        # الفهرس نسخة واحدة لكل (ServicePlan، أعمدة الخدمات)، فتغير النسخة يعني تغير الشرائح أو أسماء الخدمات
+        plan_index = get_service_plan_index(all_sheets)
+        with self._lock:
+            if plan_index is not self.plan_index:
+                self.plan_index = plan_index
+                self._machines = {}
+            return plan_index
+
+    def machine(self, all_sheets, card_num, sheet_name, store=None):
+        """صفوف المصفوفة لماكينة واحدة (قائمة بنتيجة كل شريحة بترتيب ServicePlan)"""
+        plan_index = self._plan(all_sheets)
+        plan_df = plan_index.plan_df
+        sheet_hash = all_sheets.sheet_hash(sheet_name)
+        with self._lock:
+            state = self._machines.get(card_num)
+        if state and state["plan"] is plan_index and state["sheet"] == sheet_name and state["hash"] == sheet_hash:
+            return state["slices"]
+
+        services_df = load_card_services(all_sheets, sheet_name, store, plan_df)
+        row_hashes = pd.util.hash_pandas_object(services_df, index=False).to_numpy() if len(services_df) else np.array([], dtype=np.uint64)
+        overlaps = slice_row_overlaps(plan_df, services_df)
+        columns = tuple(services_df.columns)
+        reusable = state is not None and state["plan"] is plan_index and state["sheet"] == sheet_name and state["columns"] == columns
+
+        keys, slices = [], []
+        for position in range(len(plan_df)):
+            rows = np.flatnonzero(overlaps[position])
+            key = tuple(row_hashes[rows])
+            if reusable and state["keys"][position] == key:
+                slices.append(state["slices"][position])
+            else:
+                slices.append(compute_service_status(
+                    card_num, services_df.iloc[rows], plan_df.iloc[[position]],
+                    [plan_index.needed_services[position]], plan_index.registry
+                ))
+                self.recomputed_slices += 1
+            keys.append(key)
+
+        with self._lock:
+            if self.plan_index is plan_index:
+                self._machines[card_num] = {
+                    "plan": plan_index, "sheet": sheet_name, "hash": sheet_hash,
+                    "columns": columns, "keys": keys, "slices": slices,
+                }
+        return slices
+
+    def lookup(self, all_sheets, card_num, sheet_name, positions, store=None):
+        """(result_df, service_stats) لشرائح محددة من ServicePlan"""
+        slices = self.machine(all_sheets, card_num, sheet_name, store)
+        return combine_service_status([slices[position] for position in positions])
+
+@st.cache_resource(show_spinner=False)
+def get_compliance_matrix():
+    return ComplianceMatrix()
+
+def get_service_status(all_sheets, card_num, sheet_name, positions, store=None):
+    """نتيجة فحص السيرفيس لشرائح ServicePlan المحددة (من مصفوفة الامتثال للملفات ذات البصمة)"""
+    if hasattr(all_sheets, "sheet_hash"):
+        return get_compliance_matrix().lookup(all_sheets, card_num, sheet_name, positions, store)
+    plan_index = get_service_plan_index(all_sheets)
+    selected_slices = plan_index.plan_df.iloc[positions]
+    services_df = load_card_services(all_sheets, sheet_name, store, selected_slices)
+    return compute_service_status(
+        card_num, services_df, selected_slices,
+        [plan_index.needed_services[position] for position in positions], plan_index.registry
+    )
 
 # -------------------------------
-# 🧰 دوال مساعدة للمعالجة والنصوص
+# 🗃 ذاكرة نتائج فحص السيرفيس
 # -------------------------------
-def normalize_name(s):
-    if s is None: return ""
-    s = str(s).replace("\n", "+")
-    s = re.sub(r"[^0-9a-zA-Z\u0600-\u06FF\+\s_/.-]", " ", s)
-    s = re.sub(r"\s+", " ", s).strip().lower()
-    return s
+CacheStats = namedtuple("CacheStats", ["hits", "misses", "maxsize", "currsize"])
 
-def split_needed_services(needed_service_str):
-    if not isinstance(needed_service_str, str) or needed_service_str.strip() == "":
-        return []
-    parts = re.split(r"\+|,|\n|;", needed_service_str)
-    return [p.strip() for p in parts if p.strip() != ""]
+class ServiceResultCache:
+    """آخر نتائج فحص السيرفيس (LRU): المفتاح نسخة الملف + الماكينة + مواقع الشرائح المختارة
 
-def highlight_cell(val, col_name):
-    color_map = {
-        "Service Needed": "background-color: #fff3cd; color:#856404; font-weight:bold;",
-        "Service Done": "background-color: #d4edda; color:#155724; font-weight:bold;",
-        "Service Didn't Done": "background-color: #f8d7da; color:#721c24; font-weight:bold;",
-        "Date": "background-color: #e7f1ff; color:#004085; font-weight:bold;",
-        "Tones": "background-color: #e8f8f5; color:#0d5c4a; font-weight:bold;",
-        "Event": "background-color: #e2f0d9; color:#2e6f32; font-weight:bold;",
-        "Correction": "background-color: #fdebd0; color:#7d6608; font-weight:bold;",
-        "Servised by": "background-color: #f0f0f0; color:#333; font-weight:bold;",
-        "Card Number": "background-color: #ebdef0; color:#4a235a; font-weight:bold;"
-    }
-    return color_map.get(col_name, "")
+    أي نطاق عرض أو أطنان تؤدي لنفس الشرائح تستخدم نفس النتيجة، وتغير نسخة الملف يغير المفتاح.
+    """
 
-def style_table(row):
-    return [highlight_cell(row[col], col) for col in row.index]
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
 
-def get_user_permissions(user_role, user_permissions):
-    """الحصول على صلاحيات المستخدم بناءً على الدور والصلاحيات"""
-    # إذا كان الدور admin، يعطى جميع الصلاحيات
-    if user_role == "admin":
-        return {
-            "can_view": True,
-            "can_edit": True,
-            "can_manage_users": True,
-            "can_see_tech_support": True
-        }
-    
-    # إذا كان الدور editor
-    elif user_role == "editor":
-        return {
-            "can_view": True,
-            "can_edit": True,
-            "can_manage_users": False,
-            "can_see_tech_support": False
-        }
-    
-    # إذا كان الدور viewer أو أي دور آخر
-    else:
-        # التحقق من الصلاحيات الفردية
-        return {
-            "can_view": "view" in user_permissions or "edit" in user_permissions or "all" in user_permissions,
-            "can_edit": "edit" in user_permissions or "all" in user_permissions,
-            "can_manage_users": "manage_users" in user_permissions or "all" in user_permissions,
-            "can_see_tech_support": "tech_support" in user_permissions or "all" in user_permissions
-        }
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
 
-def get_servised_by_value(row):
-    """استخراج قيمة فني الخدمة من الصف"""
-    # قائمة بالأعمدة المحتملة لفني الخدمة
-    servised_columns = [
-        "Servised by", "SERVISED BY", "servised by", "Servised By",
-        "Serviced by", "Service by", "Serviced By", "Service By",
-        "خدم بواسطة", "تم الخدمة بواسطة", "فني الخدمة"
-    ]
-    
-    # البحث في الأعمدة المعروفة
-    for col in servised_columns:
-        if col in row.index:
-            value = str(row[col]).strip()
-            if value and value.lower() not in ["nan", "none", ""]:
-                return value
-    
-    # البحث في جميع الأعمدة التي قد تحتوي على فني الخدمة
-    for col in row.index:
-        col_normalized = normalize_name(col)
-        if any(keyword in col_normalized for keyword in ["servisedby", "servicedby", "serviceby", "خدمبواسطة", "فني"]):
-            value = str(row[col]).strip()
-            if value and value.lower() not in ["nan", "none", ""]:
-                return value
-    
-    return "-"
+    def put(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def info(self):
+        with self._lock:
+            return CacheStats(self.hits, self.misses, self.max_entries, len(self._entries))
+
+@st.cache_resource(show_spinner=False)
+def get_service_result_cache():
+    return ServiceResultCache(APP_CONFIG["SERVICE_RESULT_CACHE_SIZE"])
+
+def get_service_check(all_sheets, card_num, sheet_name, positions, store=None):
+    """(result_df, service_stats, ملف Excel للنتائج) لفحص ماكينة - من الذاكرة إن سبق نفس الفحص على نفس النسخة"""
+    version = getattr(all_sheets, "version", None)
+    key = (version, card_num, sheet_name, tuple(int(position) for position in positions))
+    cache = get_service_result_cache()
+    if version is not None:
+        entry = cache.get(key)
+        if entry is not None:
+            return entry
+
+    result_df, service_stats = get_service_status(all_sheets, card_num, sheet_name, positions, store)
+    report_bytes = None
+    if not result_df.empty:
+        buffer = io.BytesIO()
+        result_df.to_excel(buffer, index=False, engine="openpyxl")
+        report_bytes = buffer.getvalue()
+
+    entry = (result_df, service_stats, report_bytes)
+    if version is not None:
+        cache.put(key, entry)
+    return entry
 
 # -------------------------------
 # 🖥 دالة فحص السيرفيس فقط - من الشيتات الجديدة
@@ -529,28 +2999,11 @@ def check_service_status(card_num, current_tons, all_sheets):
         st.error("❌ الملف لا يحتوي على شيت ServicePlan.")
         return
     
-    service_plan_df = all_sheets["ServicePlan"]
-    card_services_sheet_name = f"Card{card_num}_Services"
-    
-    # إذا لم يكن هناك شيت خدمات منفصل، نبحث في الشيت القديم
-    if card_services_sheet_name not in all_sheets:
-        # محاولة البحث في الشيت القديم
-        card_old_sheet_name = f"Card{card_num}"
-        if card_old_sheet_name in all_sheets:
-            card_df = all_sheets[card_old_sheet_name]
-            # فلترة فقط الصفوف التي لها Min_Tones و Max_Tones
-            services_df = card_df[
-                (card_df.get("Min_Tones", pd.NA).notna()) & 
-                (card_df.get("Max_Tones", pd.NA).notna()) &
-                (card_df.get("Min_Tones", "") != "") & 
-                (card_df.get("Max_Tones", "") != "")
-            ].copy()
-        else:
-            st.warning(f"⚠ لا يوجد شيت باسم {card_services_sheet_name} أو {card_old_sheet_name}")
-            return
-    else:
-        card_df = all_sheets[card_services_sheet_name]
-        services_df = card_df.copy()
+    store = get_sqlite_store(all_sheets)
+    services_sheet_name = find_card_services_sheet(all_sheets, card_num)
+    if services_sheet_name is None:
+        st.warning(f"⚠ لا يوجد شيت باسم Card{card_num}_Services أو Card{card_num}")
+        return
 
     st.subheader("⚙ نطاق العرض")
     view_option = st.radio(
@@ -570,141 +3023,12 @@ def check_service_status(card_num, current_tons, all_sheets):
             max_range = st.number_input("إلى (طن):", min_value=min_range, step=100, value=max_range, key=f"service_max_range_{card_num}")
 
     # اختيار الشرائح
-    if view_option == "الشريحة الحالية فقط":
-        selected_slices = service_plan_df[(service_plan_df["Min_Tones"] <= current_tons) & (service_plan_df["Max_Tones"] >= current_tons)]
-    elif view_option == "كل الشرائح الأقل":
-        selected_slices = service_plan_df[service_plan_df["Max_Tones"] <= current_tons]
-    elif view_option == "كل الشرائح الأعلى":
-        selected_slices = service_plan_df[service_plan_df["Min_Tones"] >= current_tons]
-    elif view_option == "نطاق مخصص":
-        selected_slices = service_plan_df[(service_plan_df["Min_Tones"] >= min_range) & (service_plan_df["Max_Tones"] <= max_range)]
-    else:
-        selected_slices = service_plan_df.copy()
-
-    if selected_slices.empty:
+    positions = get_service_plan_index(all_sheets).positions(view_option, current_tons, min_range, max_range)
+    if len(positions) == 0:
         st.warning("⚠ لا توجد شرائح مطابقة حسب النطاق المحدد.")
         return
 
-    all_results = []
-    service_stats = {
-        "service_counts": {},  # تعداد كل خدمة مطلوبة
-        "service_done_counts": {},  # تعداد الخدمات المنفذة
-        "total_needed_services": 0,
-        "total_done_services": 0,
-        "by_slice": {}  # إحصائيات حسب الشريحة
-    }
-    
-    for _, current_slice in selected_slices.iterrows():
-        slice_min = current_slice["Min_Tones"]
-        slice_max = current_slice["Max_Tones"]
-        slice_key = f"{slice_min}-{slice_max}"
-        
-        needed_service_raw = current_slice.get("Service", "")
-        needed_parts = split_needed_services(needed_service_raw)
-        needed_norm = [normalize_name(p) for p in needed_parts]
-        
-        # تحديث إحصائيات الخدمات المطلوبة
-        service_stats["by_slice"][slice_key] = {
-            "needed": needed_parts,
-            "done": [],
-            "not_done": [],
-            "total_needed": len(needed_parts),
-            "total_done": 0
-        }
-        
-        for service in needed_parts:
-            service_stats["service_counts"][service] = service_stats["service_counts"].get(service, 0) + 1
-        service_stats["total_needed_services"] += len(needed_parts)
-
-        # البحث في خدمات الماكينة
-        mask = (services_df.get("Min_Tones", 0).fillna(0) <= slice_max) & (services_df.get("Max_Tones", 0).fillna(0) >= slice_min)
-        matching_rows = services_df[mask]
-
-        if not matching_rows.empty:
-            for _, row in matching_rows.iterrows():
-                done_services_set = set()
-                
-                # تحديد الأعمدة التي تحتوي على خدمات منجزة (استبعاد أعمدة البيانات الوصفية)
-                metadata_columns = {
-                    "card", "Tones", "Min_Tones", "Max_Tones", "Date", 
-                    "Other", "Servised by", "Event", "Correction",
-                    "Card", "TONES", "MIN_TONES", "MAX_TONES", "DATE",
-                    "OTHER", "EVENT", "CORRECTION", "SERVISED BY",
-                    "servised by", "Servised By", 
-                    "Serviced by", "Service by", "Serviced By", "Service By",
-                    "خدم بواسطة", "تم الخدمة بواسطة", "فني الخدمة"
-                }
-                
-                all_columns = set(services_df.columns)
-                service_columns = all_columns - metadata_columns
-                
-                final_service_columns = set()
-                for col in service_columns:
-                    col_normalized = normalize_name(col)
-                    metadata_normalized = {normalize_name(mc) for mc in metadata_columns}
-                    if col_normalized not in metadata_normalized:
-                        final_service_columns.add(col)
-                
-                for col in final_service_columns:
-                    val = str(row.get(col, "")).strip()
-                    if val and val.lower() not in ["nan", "none", "", "null", "0"]:
-                        if val.lower() not in ["no", "false", "not done", "لم تتم", "x", "-"]:
-                            done_services_set.add(col)
-                            # تحديث إحصائيات الخدمات المنفذة
-                            service_stats["service_done_counts"][col] = service_stats["service_done_counts"].get(col, 0) + 1
-                            service_stats["total_done_services"] += 1
-
-                # جمع بيانات السيرفيس فقط
-                current_date = str(row.get("Date", "")).strip() if pd.notna(row.get("Date")) else "-"
-                current_tones = str(row.get("Tones", "")).strip() if pd.notna(row.get("Tones")) else "-"
-                
-                # البحث عن فني الخدمة
-                servised_by_value = get_servised_by_value(row)
-                
-                done_services = sorted(list(done_services_set))
-                done_norm = [normalize_name(c) for c in done_services]
-                
-                # تحديث إحصائيات الشريحة
-                service_stats["by_slice"][slice_key]["done"].extend(done_services)
-                service_stats["by_slice"][slice_key]["total_done"] += len(done_services)
-                
-                # مقارنة الخدمات المنجزة مع المطلوبة
-                not_done = []
-                for needed_part, needed_norm_part in zip(needed_parts, needed_norm):
-                    if needed_norm_part not in done_norm:
-                        not_done.append(needed_part)
-                
-                service_stats["by_slice"][slice_key]["not_done"].extend(not_done)
-
-                all_results.append({
-                    "Card Number": card_num,
-                    "Min_Tons": slice_min,
-                    "Max_Tons": slice_max,
-                    "Service Needed": " + ".join(needed_parts) if needed_parts else "-",
-                    "Service Done": ", ".join(done_services) if done_services else "-",
-                    "Service Didn't Done": ", ".join(not_done) if not_done else "-",
-                    "Tones": current_tones,
-                    "Servised by": servised_by_value,
-                    "Date": current_date
-                })
-        else:
-            # إذا لم توجد سجلات سيرفيس
-            all_results.append({
-                "Card Number": card_num,
-                "Min_Tons": slice_min,
-                "Max_Tons": slice_max,
-                "Service Needed": " + ".join(needed_parts) if needed_parts else "-",
-                "Service Done": "-",
-                "Service Didn't Done": ", ".join(needed_parts) if needed_parts else "-",
-                "Tones": "-",
-                "Servised by": "-",
-                "Date": "-"
-            })
-            
-            # تحديث إحصائيات الشريحة (لا يوجد خدمات منفذة)
-            service_stats["by_slice"][slice_key]["not_done"] = needed_parts.copy()
-
-    result_df = pd.DataFrame(all_results).dropna(how="all").reset_index(drop=True)
+    result_df, service_stats, report_bytes = get_service_check(all_sheets, card_num, services_sheet_name, positions, store)
 
     st.markdown("### 📋 نتائج فحص السيرفيس")
     if not result_df.empty:
@@ -714,11 +3038,9 @@ def check_service_status(card_num, current_tons, all_sheets):
         show_service_statistics(service_stats, result_df)
 
         # تنزيل النتائج
-        buffer = io.BytesIO()
-        result_df.to_excel(buffer, index=False, engine="openpyxl")
         st.download_button(
             label="💾 حفظ النتائج كـ Excel",
-            data=buffer.getvalue(),
+            data=report_bytes,
             file_name=f"Service_Report_Card{card_num}.xlsx",
             mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
         )
@@ -1007,6 +3329,171 @@ def show_service_statistics(service_stats, result_df):
         else:
             st.info("ℹ️ لا توجد بيانات إحصائية للشرائح.")
 
+# -------------------------------
+# 🏭 فحص السيرفيس لكل الماكينات دفعة واحدة
+# -------------------------------
+FLEET_CARD_COLUMNS = {"card", "card number", "card no", "machine", "رقم الماكينة", "الماكينة"}
+FLEET_TONS_COLUMNS = {"current_tones", "current tones", "current_tons", "current tons", "tones", "الأطنان الحالية", "الأطنان"}
+
+def read_fleet_tonnage(df):
+    """جدول (Card Number, Current_Tones) من شيت Machine أو من جدول مرفوع"""
+    card_col = next((col for col in df.columns if normalize_name(col) in FLEET_CARD_COLUMNS), None)
+    tons_col = next((col for col in df.columns if normalize_name(col) in FLEET_TONS_COLUMNS), None)
+    if card_col is None or tons_col is None:
+        return None
+
+    fleet_df = pd.DataFrame({
+        "Card Number": pd.to_numeric(df[card_col], errors="coerce"),
+        "Current_Tones": pd.to_numeric(df[tons_col], errors="coerce"),
+    }).dropna(subset=["Card Number"])
+    fleet_df["Card Number"] = fleet_df["Card Number"].astype(int)
+    return fleet_df.drop_duplicates("Card Number", keep="last").sort_values("Card Number").reset_index(drop=True)
+
+def _fleet_machine_status(all_sheets, card_num, current_tons, sheet_name, positions, store):
+    """حالة ماكينة واحدة: صف الملخص + الخدمات (منفذة/متأخرة) + تفاصيل الفحص"""
+    plan_index = get_service_plan_index(all_sheets)
+    selected_slices = plan_index.plan_df.iloc[positions]
+    result_df, service_stats = get_service_status(all_sheets, card_num, sheet_name, positions, store)
+
+    registry = plan_index.registry
+    services = {}
+    for slice_stats in service_stats["by_slice"].values():
+        done_mask = registry.mask(slice_stats["done"])
+        for service_id in (registry.id(service) for service in slice_stats["needed"]):
+            # الخدمة متأخرة إذا لم تُنفذ في أي شريحة مطلوبة فيها
+            service = registry.label(service_id)
+            services[service] = services.get(service, True) and bool(done_mask >> service_id & 1)
+
+    missing = [service for service, done in services.items() if not done]
+    summary = {
+        "Card Number": card_num,
+        "Current_Tones": current_tons,
+        "Slices": ", ".join(f"{a}-{b}" for a, b in zip(selected_slices["Min_Tones"], selected_slices["Max_Tones"])),
+        "Needed": len(services),
+        "Done": len(services) - len(missing),
+        "Completion %": round((len(services) - len(missing)) / len(services) * 100, 1) if services else 100.0,
+        "Overdue Services": ", ".join(missing) if missing else "-",
+        "Status": "⚠ متأخر" if missing else "✅ مكتمل",
+    }
+    return summary, services, result_df
+
+def compute_fleet_service_status(all_sheets, fleet_df, view_option="الشريحة الحالية فقط"):
+    """فحص السيرفيس لكل الماكينات: (ملخص لكل ماكينة، مصفوفة الخدمات منفذة/متأخرة، التفاصيل)"""
+    store = get_sqlite_store(all_sheets)
+    plan_index = get_service_plan_index(all_sheets)
+    tons = fleet_df["Current_Tones"].to_numpy(dtype=float)
+
+    # الشرائح لكل الماكينات بعملية بحث واحدة على الفهرس
+    if view_option == "كل الشرائح الأقل":
+        slice_positions = plan_index.below_many(np.nan_to_num(tons, nan=-np.inf))
+    else:
+        slice_positions = plan_index.containing_many(np.nan_to_num(tons, nan=-np.inf))
+
+    jobs = []
+    summaries = {}
+    for (card_num, current_tons), positions in zip(fleet_df[["Card Number", "Current_Tones"]].itertuples(index=False), slice_positions):
+        base = {"Card Number": card_num, "Current_Tones": current_tons, "Slices": "-", "Needed": 0, "Done": 0,
+                "Completion %": None, "Overdue Services": "-"}
+        sheet_name = find_card_services_sheet(all_sheets, card_num)
+        if sheet_name is None:
+            summaries[card_num] = {**base, "Status": "❔ لا يوجد شيت"}
+        elif pd.isna(current_tons):
+            summaries[card_num] = {**base, "Status": "❔ لا توجد أطنان"}
+        elif len(positions) == 0:
+            summaries[card_num] = {**base, "Status": "❔ لا توجد شريحة"}
+        else:
+            jobs.append((all_sheets, card_num, current_tons, sheet_name, positions, store))
+
+    workers = APP_CONFIG["FLEET_WORKERS"] or os.cpu_count() or 1
+    matrix = {}
+    details = []
+    if jobs:
+        with ThreadPoolExecutor(max_workers=min(workers, len(jobs))) as pool:
+            for summary, services, result_df in pool.map(lambda job: _fleet_machine_status(*job), jobs):
+                summaries[summary["Card Number"]] = summary
+                matrix[summary["Card Number"]] = {service: "✅" if done else "❌" for service, done in services.items()}
+                details.append(result_df)
+
+    summary_df = pd.DataFrame([summaries[card_num] for card_num in fleet_df["Card Number"]])
+    matrix_df = pd.DataFrame.from_dict(matrix, orient="index").fillna("")
+    matrix_df = matrix_df.reindex([card_num for card_num in fleet_df["Card Number"] if card_num in matrix])
+    matrix_df.index.name = "Card Number"
+    details_df = pd.concat(details, ignore_index=True) if details else pd.DataFrame()
+    return summary_df, matrix_df, details_df
+
+def build_fleet_report(summary_df, matrix_df, details_df):
+    """ملف Excel لتقرير كل الماكينات (الملخص، المصفوفة، التفاصيل)"""
+    buffer = io.BytesIO()
+    with pd.ExcelWriter(buffer, engine="openpyxl") as writer:
+        summary_df.to_excel(writer, sheet_name="Fleet Summary", index=False)
+        matrix_df.to_excel(writer, sheet_name="Service Matrix")
+        details_df.to_excel(writer, sheet_name="Details", index=False)
+    return buffer.getvalue()
+
+def fleet_service_check(all_sheets):
+    """واجهة فحص السيرفيس لكل الماكينات دفعة واحدة"""
+    source = st.radio(
+        "مصدر الأطنان الحالية:",
+        ("شيت Machine", "رفع جدول"),
+        horizontal=True,
+        key="fleet_tons_source"
+    )
+
+    if source == "شيت Machine":
+        if "Machine" not in all_sheets:
+            st.warning("⚠ الملف لا يحتوي على شيت Machine.")
+            return
+        fleet_df = read_fleet_tonnage(all_sheets["Machine"])
+    else:
+        uploaded = st.file_uploader("جدول الأطنان (xlsx أو csv) بعمودي card و Current_Tones:", type=["xlsx", "csv"], key="fleet_upload")
+        if uploaded is None:
+            return
+        try:
+            uploaded_df = pd.read_csv(uploaded) if uploaded.name.lower().endswith(".csv") else pd.read_excel(uploaded)
+        except Exception as e:
+            st.error(f"❌ تعذر قراءة الجدول: {e}")
+            return
+        fleet_df = read_fleet_tonnage(uploaded_df)
+
+    if fleet_df is None or fleet_df.empty:
+        st.warning("⚠ لم يتم العثور على عمودي رقم الماكينة والأطنان الحالية.")
+        return
+
+    view_option = st.radio(
+        "الشرائح المطلوب فحصها:",
+        ("الشريحة الحالية فقط", "كل الشرائح الأقل"),
+        horizontal=True,
+        key="fleet_view_option"
+    )
+
+    if "ServicePlan" not in all_sheets:
+        st.error("❌ الملف لا يحتوي على شيت ServicePlan.")
+        return
+
+    summary_df, matrix_df, details_df = compute_fleet_service_status(all_sheets, fleet_df, view_option)
+
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.metric("🏭 عدد الماكينات", len(summary_df))
+    with col2:
+        st.metric("✅ مكتملة", int((summary_df["Status"] == "✅ مكتمل").sum()))
+    with col3:
+        st.metric("⚠ متأخرة", int((summary_df["Status"] == "⚠ متأخر").sum()))
+
+    st.markdown("### 📋 ملخص الماكينات")
+    st.dataframe(summary_df, use_container_width=True)
+
+    if not matrix_df.empty:
+        st.markdown("### 🧮 مصفوفة الخدمات (✅ منفذة / ❌ متأخرة)")
+        st.dataframe(matrix_df, use_container_width=True)
+
+    st.download_button(
+        label="💾 حفظ تقرير كل الماكينات كـ Excel",
+        data=build_fleet_report(summary_df, matrix_df, details_df),
+        file_name="Fleet_Service_Report.xlsx",
+        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+    )
+
 # -------------------------------
 # 🖥 دالة فحص الإيفينت والكوريكشن - واجهة مبسطة واحترافية
 # -------------------------------
@@ -1196,19 +3683,36 @@ def check_events_and_corrections(all_sheets):
 
 def extract_available_techs(all_sheets):
     """استخراج أسماء فنيي الخدمة المتاحة في البيانات"""
+    store = get_sqlite_store(all_sheets)
+    if store is not None:
+        return sorted(store.techs())
+
     techs_set = set()
     
-    for sheet_name, df in all_sheets.items():
+    for sheet_name in all_sheets.keys():
         if sheet_name == "ServicePlan":
             continue
-            
-        for _, row in df.iterrows():
-            tech = get_servised_by_value(row)
-            if tech != "-":
-                techs_set.add(tech)
+
+        if hasattr(all_sheets, "sheet_hash"):
+            techs_set.update(_sheet_techs_cached(all_sheets, all_sheets.sheet_hash(sheet_name), sheet_name))
+        else:
+            techs_set.update(_sheet_techs(all_sheets[sheet_name]))
     
     return sorted(list(techs_set))
 
+def _sheet_techs(df):
+    techs = set()
+    roles = column_roles(df.columns)
+    for _, row in df.iterrows():
+        tech = get_servised_by_value(row, roles)
+        if tech != "-":
+            techs.add(tech)
+    return techs
+
+@st.cache_data(show_spinner=False, max_entries=256)
+def _sheet_techs_cached(_all_sheets, sheet_hash, sheet_name):
+    return _sheet_techs(_all_sheets[sheet_name])
+
 def show_search_params(search_params):
     """عرض معايير البحث المستخدمة"""
     with st.container():
@@ -1268,41 +3772,23 @@ def show_advanced_search_results(search_params, all_sheets):
         terms = search_params["search_text"].split(',')
         search_terms = [term.strip().lower() for term in terms if term.strip()]
     
-    # البحث في جميع الشيتات
-    for sheet_name in all_sheets.keys():
-        if sheet_name == "ServicePlan":
-            continue
-        
-        # استخراج رقم الماكينة
-        card_num_match = re.search(r'Card(\d+)', sheet_name)
-        if not card_num_match:
-            continue
-            
-        card_num = int(card_num_match.group(1))
-        
-        # التحقق من رقم الماكينة إذا كان هناك تحديد
-        if target_card_numbers and card_num not in target_card_numbers:
-            continue
-        
+    # البحث في جميع الشيتات - الصفوف تُقرأ على دفعات وتُعرض النتائج أولاً بأول
+    live_preview = st.empty()
+    for sheet_name, card_num in iter_card_sheet_names(all_sheets, target_card_numbers):
         processed_machines += 1
         if total_machines > 0:
-            progress_bar.progress(processed_machines / total_machines)
-        status_text.text(f"🔍 جاري معالجة الماكينة {card_num}...")
-        
-        df = all_sheets[sheet_name].copy()
-        
-        # البحث في الصفوف
-        for _, row in df.iterrows():
-            # تطبيق معايير البحث
-            if not check_row_criteria(row, df, card_num, target_techs, target_dates, 
-                                     search_terms, search_params):
-                continue
-            
-            # استخراج البيانات
-            result = extract_row_data(row, df, card_num)
-            if result:
-                all_results.append(result)
-    
+            progress_bar.progress(min(processed_machines / total_machines, 1.0))
+        status_text.text(f"🔍 جاري معالجة الماكينة {card_num}... (النتائج حتى الآن: {len(all_results)})")
+
+        all_results.extend(
+            search_card_sheet(all_sheets, sheet_name, card_num, target_techs, target_dates, search_terms, search_params)
+        )
+
+        if all_results:
+            live_preview.dataframe(pd.DataFrame(all_results[:20]), use_container_width=True)
+
+    live_preview.empty()
+
     # إخفاء شريط التقدم
     progress_bar.empty()
     status_text.empty()
@@ -1314,13 +3800,84 @@ def show_advanced_search_results(search_params, all_sheets):
         st.warning("⚠ لم يتم العثور على نتائج تطابق معايير البحث")
         st.info("💡 حاول تعديل معايير البحث أو استخدام مصطلحات أوسع")
 
+def iter_card_sheet_names(all_sheets, target_card_numbers=None):
+    """توليد (اسم الشيت، رقم الماكينة) لشيتات الماكينات المطلوبة بدون تحميل بياناتها"""
+    for sheet_name in all_sheets.keys():
+        if sheet_name == "ServicePlan":
+            continue
+
+        # استخراج رقم الماكينة
+        card_num_match = re.search(r'Card(\d+)', sheet_name)
+        if not card_num_match:
+            continue
+
+        card_num = int(card_num_match.group(1))
+
+        # التحقق من رقم الماكينة إذا كان هناك تحديد
+        if target_card_numbers and card_num not in target_card_numbers:
+            continue
+
+        yield sheet_name, card_num
+
+def iter_sheet_chunks(all_sheets, sheet_name):
+    """توليد دفعات صفوف شيت واحد - من اللقطة مباشرة إن أمكن"""
+    if hasattr(all_sheets, "iter_chunks"):
+        yield from all_sheets.iter_chunks(sheet_name, APP_CONFIG["SEARCH_CHUNK_ROWS"])
+    else:
+        yield all_sheets[sheet_name]
+
+def search_card_sheet(all_sheets, sheet_name, card_num, target_techs, target_dates, search_terms, search_params):
+    """نتائج البحث في شيت ماكينة واحد (مخبأة حسب بصمة محتوى الشيت ومعايير البحث)"""
+    store = get_sqlite_store(all_sheets)
+    if store is not None:
+        return store.search_sheet(sheet_name, target_techs, target_dates, search_terms, search_params)
+
+    if hasattr(all_sheets, "sheet_hash"):
+        return _search_card_sheet_cached(
+            all_sheets, all_sheets.sheet_hash(sheet_name), sheet_name, card_num,
+            tuple(target_techs), tuple(target_dates), tuple(search_terms),
+            search_params["exact_match"], search_params["include_empty"]
+        )
+
+    return [
+        result
+        for chunk in iter_sheet_chunks(all_sheets, sheet_name)
+        for result in iter_search_matches(chunk, card_num, target_techs, target_dates, search_terms, search_params)
+    ]
+
+@st.cache_data(show_spinner=False, max_entries=1024)
+def _search_card_sheet_cached(_all_sheets, sheet_hash, sheet_name, card_num, target_techs, target_dates,
+                              search_terms, exact_match, include_empty):
+    search_params = {"exact_match": exact_match, "include_empty": include_empty}
+    return [
+        result
+        for chunk in iter_sheet_chunks(_all_sheets, sheet_name)
+        for result in iter_search_matches(chunk, card_num, list(target_techs), list(target_dates),
+                                          list(search_terms), search_params)
+    ]
+
+def iter_search_matches(df, card_num, target_techs, target_dates, search_terms, search_params):
+    """توليد نتائج الصفوف المطابقة لمعايير البحث من دفعة صفوف واحدة"""
+    roles = column_roles(df.columns)
+    for _, row in df.iterrows():
+        # تطبيق معايير البحث
+        if not check_row_criteria(row, df, card_num, target_techs, target_dates,
+                                  search_terms, search_params, roles):
+            continue
+
+        # استخراج البيانات
+        result = extract_row_data(row, df, card_num, roles)
+        if result:
+            yield result
+
 def check_row_criteria(row, df, card_num, target_techs, target_dates, 
-                      search_terms, search_params):
+                      search_terms, search_params, roles=None):
     """التحقق من مطابقة الصف لمعايير البحث"""
+    roles = roles or column_roles(df.columns)
     
     # 1. التحقق من فني الخدمة
     if target_techs:
-        row_tech = get_servised_by_value(row).lower()
+        row_tech = get_servised_by_value(row, roles).lower()
         if row_tech == "-" and not search_params["include_empty"]:
             return False
         
@@ -1362,7 +3919,7 @@ def check_row_criteria(row, df, card_num, target_techs, target_dates,
     
     # 3. التحقق من نص البحث
     if search_terms:
-        row_event, row_correction = extract_event_correction(row, df)
+        row_event, row_correction = extract_event_correction(row, df, roles)
         row_event_lower = row_event.lower()
         row_correction_lower = row_correction.lower()
         
@@ -1387,37 +3944,38 @@ def check_row_criteria(row, df, card_num, target_techs, target_dates,
     
     return True
 
-def extract_event_correction(row, df):
+def extract_event_correction(row, df, roles=None):
     """استخراج الحدث والتصحيح من الصف"""
+    roles = roles or column_roles(df.columns)
     event_value = "-"
     correction_value = "-"
     
-    for col in df.columns:
-        col_normalized = normalize_name(col)
-        if "event" in col_normalized or "الحدث" in col_normalized:
-            if col in row and pd.notna(row[col]) and str(row[col]).strip() != "":
-                event_value = str(row[col]).strip()
-        
-        if "correction" in col_normalized or "تصحيح" in col_normalized:
-            if col in row and pd.notna(row[col]) and str(row[col]).strip() != "":
-                correction_value = str(row[col]).strip()
+    # آخر عمود فيه قيمة هو الذي يُعتمد (بترتيب أعمدة الشيت)
+    for col in roles.event:
+        if col in row and pd.notna(row[col]) and str(row[col]).strip() != "":
+            event_value = str(row[col]).strip()
+    
+    for col in roles.correction:
+        if col in row and pd.notna(row[col]) and str(row[col]).strip() != "":
+            correction_value = str(row[col]).strip()
     
     return event_value, correction_value
 
-def extract_row_data(row, df, card_num):
+def extract_row_data(row, df, card_num, roles=None):
     """استخراج بيانات الصف"""
     card_num_value = str(row.get("card", "")).strip() if pd.notna(row.get("card")) else str(card_num)
     date = str(row.get("Date", "")).strip() if pd.notna(row.get("Date")) else "-"
     tones = str(row.get("Tones", "")).strip() if pd.notna(row.get("Tones")) else "-"
     
-    event_value, correction_value = extract_event_correction(row, df)
+    roles = roles or column_roles(df.columns)
+    event_value, correction_value = extract_event_correction(row, df, roles)
     
     # إذا كانت كل الحقول فارغة، نتجاهل الصف
     if (event_value == "-" and correction_value == "-" and 
         date == "-" and tones == "-"):
         return None
     
-    servised_by_value = get_servised_by_value(row)
+    servised_by_value = get_servised_by_value(row, roles)
     
     return {
         "Card Number": card_num_value,
@@ -1754,21 +4312,15 @@ def add_new_event(sheets_edit):
         if serviced_by.strip():
             new_row[servised_col] = serviced_by.strip()
         
-        # إضافة الصف الجديد
-        new_row_df = pd.DataFrame([new_row]).astype(str)
-        df_new = pd.concat([df, new_row_df], ignore_index=True)
-        
-        sheets_edit[sheet_name] = df_new.astype(object)
-        
-        # حفظ تلقائي في GitHub
-        new_sheets = auto_save_to_github(
-            sheets_edit,
-            f"إضافة حدث جديد في {sheet_name}"
-        )
-        if new_sheets is not None:
-            sheets_edit = new_sheets
-            st.success("✅ تم إضافة الحدث الجديد بنجاح!")
-            st.rerun()
+        # إضافة الصف الجديد لسجل الأحداث (يظهر فوراً في البحث والفحص، ويُدمج في الملف ويُرفع لاحقاً)
+        try:
+            get_event_journal().append(sheet_name, new_row, st.session_state.get("username", "unknown"))
+            maybe_compact_event_journal()
+        except Exception as e:
+            st.error(f"❌ فشل حفظ الحدث الجديد: {e}")
+            return
+        st.success("✅ تم إضافة الحدث الجديد بنجاح!")
+        st.rerun()
 
 # -------------------------------
 # 🖥 دالة تعديل الإيفينت والكوريكشن
@@ -2187,6 +4739,17 @@ def tech_support():
         else:
             st.metric("💾 حجم الملف", "غير موجود")
     
+    # الذاكرة المؤقتة للحسابات
+    st.markdown("### ⚡ الذاكرة المؤقتة للحسابات")
+    cache_stats = {**text_cache_stats(), "service_results": get_service_result_cache().info()}
+    cache_cols = st.columns(len(cache_stats))
+    for cache_col, (name, info) in zip(cache_cols, cache_stats.items()):
+        with cache_col:
+            lookups = info.hits + info.misses
+            hit_rate = info.hits / lookups * 100 if lookups else 0
+            st.metric(f"🧮 {name}", f"{hit_rate:.1f}%")
+            st.caption(f"hits: {info.hits} | misses: {info.misses} | الحجم: {info.currsize}/{info.maxsize}")
+    
     st.markdown("---")
     
     # معلومات الجلسة الحالية
@@ -2238,9 +4801,12 @@ with st.sidebar:
             logout_action()
 
     st.markdown("---")
+    show_sync_status()
     st.write("🔧 أدوات:")
     if st.button("🔄 تحديث الملف من GitHub", key="refresh_github"):
-        if fetch_from_github_requests():
+        if get_sync_worker().has_pending():
+            st.warning("⚠ توجد تعديلات محلية لم تُرفع بعد، انتظر انتهاء المزامنة قبل التحديث من GitHub.")
+        elif fetch_from_github_requests():
             st.rerun()
     
     # زر مسح الكاش
@@ -2269,11 +4835,11 @@ with st.sidebar:
     if st.button("🚪 تسجيل الخروج", key="logout_btn"):
         logout_action()
 
-# تحميل الشيتات (عرض وتحليل)
-all_sheets = load_all_sheets()
+# متابعة نسخ GitHub الجديدة في الخلفية (الاستبدال يتم بين التشغيلات وليس أثناءها)
+start_background_refresh()
 
-# تحميل الشيتات للتحرير (dtype=object)
-sheets_edit = load_sheets_for_edit()
+# تحميل الشيتات (عرض وتحليل) - لقطة مشتركة، وكل شيت يُقرأ عند أول استخدام فقط
+all_sheets = load_all_sheets()
 
 # واجهة التبويبات الرئيسية
 st.title(f"{APP_CONFIG['APP_ICON']} {APP_CONFIG['APP_TITLE']}")
@@ -2284,6 +4850,9 @@ user_role = st.session_state.get("user_role", "viewer")
 user_permissions = st.session_state.get("user_permissions", ["view"])
 permissions = get_user_permissions(user_role, user_permissions)
 
+# إعادة تحميل الصفحة تلقائياً عند وصول نسخة جديدة (للمشاهدة فقط)
+watch_remote_updates(permissions["can_edit"])
+
 # تحديد التبويبات بناءً على الصلاحيات
 if permissions["can_manage_users"]:  # admin
     tabs = st.tabs(APP_CONFIG["CUSTOM_TABS"])
@@ -2311,17 +4880,26 @@ with tabs[0]:
     if all_sheets is None:
         st.warning("❗ الملف المحلي غير موجود. استخدم زر التحديث في الشريط الجانبي لتحميل الملف من GitHub.")
     else:
-        col1, col2 = st.columns(2)
-        with col1:
-            card_num = st.number_input("رقم الماكينة:", min_value=1, step=1, key="card_num_service")
-        with col2:
-            current_tons = st.number_input("عدد الأطنان الحالية:", min_value=0, step=100, key="current_tons_service")
+        service_mode = st.radio("نوع الفحص:", ("ماكينة واحدة", "كل الماكينات"), horizontal=True, key="service_mode")
 
-        if st.button("عرض حالة السيرفيس", key="show_service"):
-            st.session_state["show_service_results"] = True
+        if service_mode == "كل الماكينات":
+            if st.button("عرض حالة السيرفيس لكل الماكينات", key="show_fleet_service"):
+                st.session_state["show_fleet_results"] = True
 
-        if st.session_state.get("show_service_results", False):
-            check_service_status(card_num, current_tons, all_sheets)
+            if st.session_state.get("show_fleet_results", False):
+                fleet_service_check(all_sheets)
+        else:
+            col1, col2 = st.columns(2)
+            with col1:
+                card_num = st.number_input("رقم الماكينة:", min_value=1, step=1, key="card_num_service")
+            with col2:
+                current_tons = st.number_input("عدد الأطنان الحالية:", min_value=0, step=100, key="current_tons_service")
+
+            if st.button("عرض حالة السيرفيس", key="show_service"):
+                st.session_state["show_service_results"] = True
+
+            if st.session_state.get("show_service_results", False):
+                check_service_status(card_num, current_tons, all_sheets)
 
 # -------------------------------
 # Tab: فحص الإيفينت والكوريكشن (لجميع المستخدمين)
@@ -2343,8 +4921,10 @@ if permissions["can_edit"] and len(tabs) > 2:
         st.header("🛠 تعديل وإدارة البيانات")
 
         # تحقق صلاحية الرفع
-        token_exists = bool(st.secrets.get("github", {}).get("token", None))
-        can_push = token_exists and GITHUB_AVAILABLE
+        can_push = get_sync_backend().can_push
+
+        # تحميل الشيتات للتحرير (dtype=object)
+        sheets_edit = load_sheets_for_edit()
 
         if sheets_edit is None:
             st.warning("❗ الملف المحلي غير موجود. اضغط تحديث من GitHub في الشريط الجانبي أولًا.")